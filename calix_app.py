@@ -1,127 +1,134 @@
-from datetime import datetime
-import io
-import re
-
-import pandas as pd
 import streamlit as st
 
-from mappings import device_profile_name_map, device_numbers_template_map
+from calix_batch import convert_batch, merge_exports, zip_exports
+from calix_cache import (
+    EXPORT_CACHE,
+    cached_export,
+    export_cache_key,
+    file_digest,
+    inventory_layout,
+    parse_inventory_cached,
+    write_export_segments,
+)
+from calix_engine import (
+    MAPPINGS_PATH,
+    apply_device_overrides,
+    build_devices_from_descriptions,
+    compressed_file_name,
+    cpu_workers,
+    description_stats,
+    devices_from_counts,
+    export_file_name,
+    iter_chunks,
+    iter_shards,
+    mappings_error,
+    model_stats,
+    overlay_path,
+    refresh_mappings,
+    scan_description_stats,
+    spool_export,
+    spool_export_parts,
+    tenant_error,
+    tenant_registry,
+    write_export,
+    write_export_chunks,
+)
 
 
 # --- Helpers -----------------------------------------------------------------
 
-
-def auto_detect_header_row(df: pd.DataFrame) -> int:
+# Step 3 compression choice → compression passed to the export writer
+EXPORT_COMPRESSION_CHOICES = {
+    "None (.csv)": None,
+    "gzip (.csv.gz)": "gzip",
+    "zip": "zip",
+}
+
+EXPORT_MIME_TYPES = {
+    None: "text/csv",
+    "gzip": "application/gzip",
+    "zip": "application/zip",
+}
+
+# Step 2 identifier check table: model_stats column → heading
+VALIDATION_COLUMN_LABELS = {
+    "records": "Records",
+    "no_ids": "No MAC/SN/FSAN (skipped)",
+    "mac_invalid": "Malformed MAC",
+    "sn_invalid": "Malformed SN",
+    "fsan_invalid": "Malformed FSAN",
+}
+
+
+def stream_chunks(stream: dict):
     """
-    Try to find the row that contains header names like 'Item Description' / 'Description'
-    and 'FSAN'. Look at the first 10 rows. Fallback to row 0.
+    Iterate the streamed upload's data rows, one chunk at a time (only the
+    columns the conversion uses).
     """
-    max_scan_rows = min(10, len(df))
+    return iter_chunks(
+        stream["file"],
+        stream["file_name"],
+        stream["header_row_idx"],
+        stream["header"],
+        usecols=stream["usecols"],
+    )
 
-    # Pass 1 – look for a row that has BOTH description & FSAN-ish cells.
-    for idx in range(max_scan_rows):
-        row = df.iloc[idx]
-        cells = [str(x).strip().lower() for x in row]
-        has_desc = any("description" in c for c in cells)
-        has_fsan = any("fsan" in c for c in cells)
-        if has_desc and has_fsan:
-            return idx
 
-    # Pass 2 – any row with a description-ish header.
-    for idx in range(max_scan_rows):
-        row = df.iloc[idx]
-        cells = [str(x).strip().lower() for x in row]
-        if any("description" in c for c in cells):
-            return idx
+# Step 2 device fields the operator can change, kept when devices are
+# detected again for the same upload (see carry_device_settings)
+DEVICE_SETTING_FIELDS = ("location", "ONT_PORT", "ONT_PROFILE_ID", "exclude_mac_sn")
 
-    # Fallback
-    return 0
+# Step 2 device field → widget key prefix (see device_widget_key)
+DEVICE_WIDGET_PREFIXES = {
+    "location": "loc",
+    "ONT_PORT": "ont_port",
+    "ONT_PROFILE_ID": "ont_profile",
+}
 
 
-def device_profile_to_type(profile: str) -> str:
-    """
-    Map profile name from mappings.py to the friendly device_type used in the UI.
-    """
-    if profile == "ONT":
-        return "ONT"
-    if profile == "CX_ROUTER":
-        return "ROUTER"
-    if profile == "CX_MESH":
-        return "MESH"
-    if profile == "CX_SFP":
-        return "SFP"
-    # Fallback for anything else (GAM_COAX_ENDPOINT, etc.)
-    return "ENDPOINT"
-
-
-def build_devices_from_descriptions(df: pd.DataFrame, desc_col: str):
+def device_defaults(devices: list) -> dict:
     """
-    Scan the description column, find all known models from mappings.py, and
-    return a list of device dicts with counts and default ONT fields.
-
-    Uses regex "word-ish" boundaries so 'GM1028' does NOT match 'GM1028H'.
+    Device name → its DEVICE_SETTING_FIELDS as detected, before any edits.
     """
-    devices = []
-    desc_series = df[desc_col].astype(str)
-
-    for device_name, profile in device_profile_name_map.items():
-        # Skip ALT entries – they're used only when building device_numbers
-        if str(device_name).endswith("_ALT"):
-            continue
-
-        pattern = str(device_name)
+    return {
+        device["device_name"]: {
+            field: device.get(field) for field in DEVICE_SETTING_FIELDS
+        }
+        for device in devices
+    }
 
-        # Word-ish boundary: no letter/number immediately before or after
-        pattern_regex = rf"(?<![A-Za-z0-9-]){re.escape(pattern)}(?![A-Za-z0-9-])"
 
-        mask = desc_series.str.contains(
-            pattern_regex, case=False, na=False, regex=True
-        )
-        count = int(mask.sum())
-        if count == 0:
-            continue
-
-        # Try to pull defaults for ONT_PORT / ONT_PROFILE_ID from the template
-        template = (
-            device_numbers_template_map.get(str(device_name), "")
-            or device_numbers_template_map.get(str(device_name).upper(), "")
-        )
+def carry_device_settings(devices: list, previous: list, defaults: dict) -> list:
+    """
+    Give re-detected devices the DEVICE_SETTING_FIELDS the operator changed
+    (compared with `defaults`, see device_defaults), matched by device name.
+    Unchanged fields take the new defaults, e.g. another company's ONT_PORT.
+    """
+    overrides = {}
+    for device in previous:
+        detected = defaults.get(device["device_name"], {})
+        overrides[device["device_name"]] = {
+            field: device.get(field)
+            for field in DEVICE_SETTING_FIELDS
+            if device.get(field) != detected.get(field)
+        }
+    return apply_device_overrides(devices, overrides)
 
-        ont_port = ""
-        ont_profile_id = ""
-
-        if "ONT_PORT=" in template:
-            m = re.search(r"ONT_PORT=([^|]*)", template)
-            if m:
-                ont_port = m.group(1)
-
-        if "ONT_PROFILE_ID=" in template:
-            m = re.search(r"ONT_PROFILE_ID=([^|]*)", template)
-            if m:
-                ont_profile_id = m.group(1)
-
-        devices.append(
-            {
-                "model_name": pattern,  # used to match Item Description
-                "device_name": device_name,
-                "device_type": device_profile_to_type(profile),
-                "location": "WAREHOUSE",       # default; editable in UI
-                "ONT_PORT": ont_port,
-                "ONT_PROFILE_ID": ont_profile_id,
-                "exclude_mac_sn": False,
-                "count": count,
-            }
-        )
 
-    return devices
+def device_widget_key(field: str, device: dict) -> str:
+    """
+    Step 2 widget key for one of a device's settings. Keyed by name, so a
+    value stays with its device when the list changes.
+    """
+    return f"{DEVICE_WIDGET_PREFIXES[field]}_{device['device_name']}"
 
 
-def make_model_regex(model: str) -> str:
+def export_workers() -> int:
     """
-    Build the same 'word-ish boundary' regex used in build_devices_from_descriptions,
-    so counts and export rows line up and we avoid GM1028 vs GM1028H double matches.
+    Processes to classify/export with: all cores when the operator asked
+    for it in Step 1, else 1.
     """
-    return rf"(?<![A-Za-z0-9-]){re.escape(str(model))}(?![A-Za-z0-9-])"
+    return cpu_workers() if st.session_state.get("use_all_cores") else 1
 
 
 # --- Session state -----------------------------------------------------------
@@ -135,6 +142,33 @@ if "header_confirmed" not in st.session_state:
 if "df" not in st.session_state:
     st.session_state.df = None
 
+# Large-file streaming mode: the upload plus where its header is, instead of df
+if "stream" not in st.session_state:
+    st.session_state.stream = None
+
+# Description/MAC/SN/FSAN columns of the upload, resolved once (see
+# inventory_layout) and used by Step 2 and Step 3
+if "columns" not in st.session_state:
+    st.session_state.columns = None
+
+# Per-description record counts and identifier checks of the upload (see
+# scan_description_stats), computed once and regrouped per mappings version
+if "description_stats" not in st.session_state:
+    st.session_state.description_stats = None
+
+# model_stats of the upload for the current mappings (Step 2 check table)
+if "validation" not in st.session_state:
+    st.session_state.validation = None
+
+# Identifies the uploaded file's contents (for the export cache)
+if "dataset_key" not in st.session_state:
+    st.session_state.dataset_key = None
+
+# device_defaults of the detected devices, to tell the operator's Step 2
+# edits apart (see carry_device_settings)
+if "device_defaults" not in st.session_state:
+    st.session_state.device_defaults = {}
+
 if "auto_devices_initialized" not in st.session_state:
     st.session_state.auto_devices_initialized = False
 
@@ -144,6 +178,15 @@ if "company_name" not in st.session_state:
 if "file_name" not in st.session_state:
     st.session_state.file_name = ""
 
+# Mappings version the devices were detected with (see refresh_mappings and
+# tenant_registry)
+if "mappings_version" not in st.session_state:
+    st.session_state.mappings_version = None
+
+# Batch mode: one result dict per uploaded file, in upload order
+if "batch_results" not in st.session_state:
+    st.session_state.batch_results = []
+
 
 # --- Page setup --------------------------------------------------------------
 
@@ -166,23 +209,144 @@ This tool converts ISP inventory exports into a Calix-ready import file.
         """
     )
 
+# Pick up edits to the mappings file without restarting the server, then
+# layer the company's overlay on top (compiled once per company)
+refresh_mappings()
+tenant = st.session_state.company_name
+registry = tenant_registry(tenant)
+
+if st.session_state.mappings_version != registry["version"]:
+    if st.session_state.mappings_version and st.session_state.header_confirmed:
+        st.info(
+            "🔁 The mappings changed (edited, or another company's overlay) – "
+            "devices were detected again, keeping your Step 2 changes."
+        )
+    st.session_state.mappings_version = registry["version"]
+    st.session_state.auto_devices_initialized = False
+
+if mappings_error():
+    st.error(
+        f"❌ Could not reload the mappings ({mappings_error()}); "
+        "still using the previous version."
+    )
+
+if tenant_error(tenant):
+    st.error(
+        f"❌ Could not load the company's mapping overlay ({tenant_error(tenant)}); "
+        "still using the previous version."
+    )
+
+mapping_sources = [MAPPINGS_PATH.name]
+if overlay_path(tenant):
+    mapping_sources.append(overlay_path(tenant).name)
+    st.caption(f"🏢 Using the mapping overlay `{mapping_sources[-1]}`.")
+
+if registry["problems"]:
+    problems = registry["problems"]
+    with st.expander(
+        f"⚠️ `{' + '.join(mapping_sources)}` has {len(problems)} problem(s)",
+        expanded=False,
+    ):
+        st.markdown("\n".join(f"- {problem}" for problem in problems))
+
 # --- Reset button ------------------------------------------------------------
 
 if st.button("🔄 Reset All"):
     st.session_state.devices = []
     st.session_state.header_confirmed = False
     st.session_state.df = None
+    st.session_state.stream = None
+    st.session_state.columns = None
+    st.session_state.description_stats = None
+    st.session_state.dataset_key = None
     st.session_state.auto_devices_initialized = False
     st.session_state.file_name = ""
+    st.session_state.batch_results = []
     st.rerun()
 
-# Optional company name just for file naming
+# Optional company name for file naming and the company's mapping overlay
 st.text_input(
-    "Company name (optional – only used in export file name)",
+    "Company name (optional – used in the export file name and to pick the "
+    "company's mapping overlay)",
     key="company_name",
 )
 
 
+# --- Batch mode: many files at once -----------------------------------------
+
+with st.expander("📚 Batch mode: convert many files at once", expanded=False):
+    st.caption(
+        "Each file is converted with the default settings from `mappings.py` "
+        "and the company's mapping overlay "
+        f"(up to {cpu_workers()} files in parallel)."
+    )
+    batch_files = st.file_uploader(
+        "Upload inventory files",
+        type=["csv", "xlsx"],
+        accept_multiple_files=True,
+        key="batch_files",
+    )
+    batch_location = st.text_input(
+        "Inventory location for all devices", value="WAREHOUSE", key="batch_location"
+    )
+    batch_output = st.radio(
+        "Output",
+        ["One merged Calix file", "Zip of one Calix file per input"],
+        key="batch_output",
+    )
+
+    if batch_files and st.button("▶️ Convert all files"):
+        files = [(f.name, f.getvalue()) for f in batch_files]
+        config = {
+            "company_name": tenant,
+            "default_location": batch_location.strip() or "WAREHOUSE",
+        }
+
+        progress = st.progress(0.0, text=f"Converting {len(files)} files…")
+        results = [None] * len(files)
+        for done, (position, result) in enumerate(convert_batch(files, config), 1):
+            results[position] = result
+            if "error" in result:
+                st.write(f"❌ {result['file_name']}: {result['error']}")
+            else:
+                st.write(
+                    f"✅ {result['file_name']} – {result['total_records']} records"
+                )
+            progress.progress(done / len(files), text=f"{done}/{len(files)} files done")
+        st.session_state.batch_results = results
+
+    converted = [r for r in st.session_state.batch_results if "error" not in r]
+    failed = [r for r in st.session_state.batch_results if "error" in r]
+
+    if failed:
+        st.warning(
+            "⚠️ Not converted: " + ", ".join(f"`{r['file_name']}`" for r in failed)
+        )
+
+    if converted:
+        total_records = sum(r["total_records"] for r in converted)
+        st.info(
+            f"ℹ️ {len(converted)} files converted, **{total_records}** records "
+            "(excluding headers)."
+        )
+        if batch_output == "One merged Calix file":
+            st.download_button(
+                "⬇️ Download merged file",
+                data=lambda: merge_exports(converted),
+                file_name=export_file_name(tenant),
+                mime="text/csv",
+            )
+        else:
+            # The data callable runs later, outside the script run, so it
+            # closes over the company name instead of reading session state
+            st.download_button(
+                "⬇️ Download zip",
+                data=lambda: zip_exports(converted, tenant),
+                file_name=compressed_file_name(export_file_name(tenant), "zip"),
+                mime="application/zip",
+            )
+
+
 # --- Step 1: Upload file & auto-detect header --------------------------------
 
 with st.expander(
@@ -190,62 +354,83 @@ with st.expander(
     expanded=not st.session_state.header_confirmed,
 ):
     file = st.file_uploader("Upload your inventory file", type=["csv", "xlsx"])
+    stream_large_file = st.checkbox(
+        "Large file: stream in chunks instead of loading the whole file",
+        key="stream_large_file",
+    )
+    st.checkbox(
+        f"Large file: classify and export in row shards on all {cpu_workers()} "
+        "CPU cores",
+        key="use_all_cores",
+    )
 
     if file and not st.session_state.header_confirmed:
-        # Read with no header so we can find it ourselves
-        if file.name.lower().endswith(".csv"):
-            raw_df = pd.read_csv(file, header=None)
+        if stream_large_file:
+            # Find the header from the first rows only; keep just the upload
+            # and read rows chunk by chunk when needed
+            sample, layout, known_layout = inventory_layout(file, file.name)
+            header_row_idx = layout["header_row_idx"]
+            header = layout["header"]
+            st.session_state.df = None
+            st.session_state.stream = {
+                "file": file,
+                "file_name": file.name,
+                "header_row_idx": header_row_idx,
+                "header": header,
+                "usecols": layout["usecols"],
+                "total_rows": 0,
+            }
+            st.session_state.columns = layout["columns"]
+            st.session_state.dataset_key = f"{file_digest(file)}-stream"
+            if known_layout:
+                st.info("♻️ Known file layout – header row and columns recalled.")
         else:
-            raw_df = pd.read_excel(file, header=None)
+            # One text-typed parse, shared by every session uploading the
+            # same file (keyed by content hash)
+            parsed, cache_hit = parse_inventory_cached(file, file.name)
+            sample = parsed["sample"]
+            header_row_idx = parsed["header_row_idx"]
+            header = parsed["header"]
+            st.session_state.df = parsed["df"]
+            st.session_state.stream = None
+            st.session_state.columns = parsed["columns"]
+            st.session_state.dataset_key = parsed["dataset_key"]
+            if cache_hit:
+                st.info(
+                    "♻️ This file was parsed before – reusing the cached result."
+                )
 
         st.write("🔎 **Preview – first 5 rows (raw)**")
-        st.dataframe(raw_df.head())
-
-        header_row_idx = auto_detect_header_row(raw_df)
-        header_row = raw_df.iloc[header_row_idx].astype(str).str.strip()
-
-        df = raw_df.iloc[header_row_idx + 1 :].copy()
-        df.columns = header_row
-        df.columns = df.columns.str.strip()
+        st.dataframe(sample.head())
 
-        st.session_state.df = df
         st.session_state.header_confirmed = True
+        st.session_state.devices = []  # nothing to carry over to a new file
+        st.session_state.description_stats = None
         st.session_state.auto_devices_initialized = False
         st.session_state.file_name = file.name
 
         st.success(f"✅ Header row auto-detected at raw row index {header_row_idx}.")
         st.write("🧾 **Detected columns:**")
-        st.write(list(df.columns))
+        st.write(list(header))
 
         st.rerun()
 
 
+data_loaded = st.session_state.header_confirmed and (
+    st.session_state.df is not None or st.session_state.stream is not None
+)
+
+
 # --- Step 2: Auto-detect devices from Item Description -----------------------
 
-if st.session_state.header_confirmed and st.session_state.df is not None:
+if data_loaded:
     df = st.session_state.df
+    stream = st.session_state.stream
 
-    # Try to locate commonly-named columns
-    desc_col = next(
-        (col for col in df.columns if "description" in str(col).lower()),
-        None,
-    )
-    mac_col = next(
-        (col for col in df.columns if "mac" in str(col).lower()),
-        None,
-    )
-    sn_col = next(
-        (
-            col
-            for col in df.columns
-            if "serial" in str(col).lower() or str(col).lower() == "sn"
-        ),
-        None,
-    )
-    fsan_col = next(
-        (col for col in df.columns if "fsan" in str(col).lower()),
-        None,
-    )
+    # Commonly-named columns, found (or recalled) when the file was read
+    columns = st.session_state.columns
+    desc_col = columns["desc"]
+    fsan_col = columns["fsan"]
 
     if not desc_col:
         st.error(
@@ -260,13 +445,43 @@ if st.session_state.header_confirmed and st.session_state.df is not None:
             "If your templates require FSAN, those rows may not export correctly."
         )
 
-    # Build devices once per upload
+    # Count records and check MAC/SN/FSAN once per upload, per description;
+    # switching companies only re-matches the distinct descriptions
+    if st.session_state.description_stats is None:
+        if df is not None:
+            st.session_state.description_stats = description_stats(df, columns)
+        else:
+            stats, stream["total_rows"] = scan_description_stats(
+                stream_chunks(stream), columns, max_workers=export_workers()
+            )
+            st.session_state.description_stats = stats
+
+    # Build devices once per upload (and mappings version), keeping what the
+    # operator already set for devices detected again
     if not st.session_state.auto_devices_initialized:
-        st.session_state.devices = build_devices_from_descriptions(df, desc_col)
+        validation = model_stats(st.session_state.description_stats, registry)
+        if df is not None:
+            devices = build_devices_from_descriptions(df, desc_col, tenant)
+        else:
+            devices = devices_from_counts(validation["records"], registry)
+        defaults = device_defaults(devices)
+        devices = carry_device_settings(
+            devices, st.session_state.devices, st.session_state.device_defaults
+        )
+        st.session_state.device_defaults = defaults
+        # The widgets show these values from now on
+        for device in devices:
+            fields = ["location"]
+            if device["device_type"] == "ONT":
+                fields += ["ONT_PORT", "ONT_PROFILE_ID"]
+            for field in fields:
+                st.session_state[device_widget_key(field, device)] = device[field]
+        st.session_state.devices = devices
+        st.session_state.validation = validation
         st.session_state.auto_devices_initialized = True
 
     # --- Summary at the top so you can compare counts ------------------------
-    total_rows = len(df)
+    total_rows = len(df) if df is not None else stream["total_rows"]
     sum_device_counts = sum(d.get("count", 0) for d in st.session_state.devices)
 
     st.markdown("### 📊 File & Record Summary")
@@ -280,6 +495,26 @@ if st.session_state.header_confirmed and st.session_state.df is not None:
         "or descriptions contain patterns that don't align with `mappings.py`."
     )
 
+    # --- Identifier check ----------------------------------------------------
+    st.markdown("### 🧪 MAC / SN / FSAN check")
+
+    validation = st.session_state.validation
+    flagged = validation[validation.drop(columns="records").any(axis=1)]
+    if flagged.empty:
+        st.success("✅ Every MAC, SN and FSAN of the detected devices looks valid.")
+    else:
+        st.warning(
+            "⚠️ Some identifiers look malformed – they are exported as written, "
+            "so check them in the source file."
+        )
+        st.dataframe(
+            flagged.rename(columns=VALIDATION_COLUMN_LABELS).rename_axis("Device")
+        )
+    st.caption(
+        "MACs are exported as 12 upper-case hex digits and FSANs in upper case; "
+        "empty cells stay empty. Rows without any MAC, SN or FSAN are not exported."
+    )
+
     # --- Devices list --------------------------------------------------------
     st.markdown("### 🔍 Step 2: Devices found from Item Description")
 
@@ -298,8 +533,7 @@ if st.session_state.header_confirmed and st.session_state.df is not None:
             # Per-device inventory location (default WAREHOUSE)
             loc_input = st.text_input(
                 f"Inventory location for {device['device_name']}",
-                value=device.get("location", "WAREHOUSE") or "WAREHOUSE",
-                key=f"loc_{idx}",
+                key=device_widget_key("location", device),
             )
             st.session_state.devices[idx]["location"] = loc_input.strip() or "WAREHOUSE"
 
@@ -309,169 +543,124 @@ if st.session_state.header_confirmed and st.session_state.df is not None:
                 with c1:
                     new_port = st.text_input(
                         f"ONT_PORT for {device['device_name']}",
-                        value=device.get("ONT_PORT", ""),
-                        key=f"ont_port_{idx}",
+                        key=device_widget_key("ONT_PORT", device),
                     )
                 with c2:
                     new_profile = st.text_input(
                         f"ONT_PROFILE_ID for {device['device_name']}",
-                        value=device.get("ONT_PROFILE_ID", ""),
-                        key=f"ont_profile_{idx}",
+                        key=device_widget_key("ONT_PROFILE_ID", device),
                     )
 
                 st.session_state.devices[idx]["ONT_PORT"] = new_port
                 st.session_state.devices[idx]["ONT_PROFILE_ID"] = new_profile
 
             # Optional remove
-            if st.button("🗑️ Remove", key=f"remove_{idx}"):
+            if st.button("🗑️ Remove", key=f"remove_{device['device_name']}"):
                 st.session_state.devices.pop(idx)
                 st.rerun()
 
 
 # --- Step 3: Export ----------------------------------------------------------
 
-if st.session_state.header_confirmed and st.session_state.df is not None:
+if data_loaded:
     df = st.session_state.df
+    stream = st.session_state.stream
 
     with st.expander("📦 Step 3: Export Calix file", expanded=True):
         if not st.session_state.devices:
             st.info("No devices selected/found to export.")
             st.stop()
 
-        # Re-locate key columns (just to be safe)
-        desc_col = next(
-            (col for col in df.columns if "description" in str(col).lower()),
-            None,
-        )
-        mac_col = next(
-            (col for col in df.columns if "mac" in str(col).lower()),
-            None,
-        )
-        sn_col = next(
-            (
-                col
-                for col in df.columns
-                if "serial" in str(col).lower() or str(col).lower() == "sn"
-            ),
-            None,
-        )
-        fsan_col = next(
-            (col for col in df.columns if "fsan" in str(col).lower()),
-            None,
-        )
+        columns = st.session_state.columns
 
-        if not desc_col:
+        if not columns["desc"]:
             st.error("❌ Item Description column not found; cannot export.")
             st.stop()
 
-        # Map device profile → FSAN label in the template
-        fsan_label_map = {
-            "ONT": "ONT_FSAN",
-            "CX_ROUTER": "ROUTER_FSAN",
-            "CX_MESH": "MESH_FSAN",
-            "CX_SFP": "SIP_FSAN",
-            "GAM_COAX_ENDPOINT": "GAM_FSAN",
-        }
-
-        # Build filename
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        base_name = (
-            st.session_state.company_name.strip().replace(" ", "_")
-            if st.session_state.company_name
-            else "inventory"
+        max_records = int(
+            st.number_input(
+                "Max records per file (0 = one file; more records are split "
+                "into part files, zipped with a manifest)",
+                min_value=0,
+                step=1000,
+                key="max_records_per_file",
+            )
         )
-        export_name = f"{base_name}_{ts}.csv"
-
-        output = io.StringIO()
-        output.write(
-            "device_profile,device_name,device_numbers,inventory_location,inventory_status\n"
+        if max_records:
+            compression = "zip"
+        else:
+            compression = EXPORT_COMPRESSION_CHOICES[
+                st.radio(
+                    "Compression",
+                    list(EXPORT_COMPRESSION_CHOICES),
+                    horizontal=True,
+                    key="export_compression",
+                )
+            ]
+        export_name = compressed_file_name(
+            export_file_name(st.session_state.company_name), compression
         )
-
-        total_records = 0
-
-        for device in st.session_state.devices:
-            name = device["device_name"]
-            model = device["model_name"]
-            dtype = device["device_type"]
-
-            # Profile from mappings; fall back if somehow missing
-            profile = (
-                device_profile_name_map.get(str(name))
-                or device_profile_name_map.get(str(name).upper())
-                or f"CX_{dtype}"
+        # Files inside a zip are named without the timestamp, so a cached
+        # zip is still right for a later download
+        csv_name = export_file_name(st.session_state.company_name, timestamp=False)
+
+        # The file is only built when the button is clicked, from a snapshot
+        # of the current settings, and kept in EXPORT_CACHE under
+        # (dataset, device settings, output format, mappings version). Editing
+        # other fields costs nothing, downloading the same settings again is
+        # instant, and a new combination only rebuilds the devices whose
+        # settings changed.
+        devices = [dict(device) for device in st.session_state.devices]
+        dataset_key = st.session_state.dataset_key
+        export_key = (
+            export_cache_key(
+                dataset_key, devices, compression, max_records, tenant, csv_name
             )
+            if dataset_key
+            else None
+        )
 
-            fsan_label = fsan_label_map.get(profile, "FSAN")
+        workers = export_workers()
 
-            template_key = f"{name}_ALT" if device.get("exclude_mac_sn") else name
-            template = (
-                device_numbers_template_map.get(str(template_key))
-                or device_numbers_template_map.get(str(template_key).upper(), "")
+        def write_file(out, df=df, stream=stream, columns=columns, devices=devices):
+            if df is None:
+                return write_export_chunks(
+                    stream_chunks(stream), devices, columns, out, workers, tenant
+                )
+            if workers > 1:
+                # Same bytes as the single-core paths, rendered shard by shard
+                return write_export_chunks(
+                    iter_shards(df), devices, columns, out, workers, tenant
+                )
+            if export_key is None:
+                return write_export(df, devices, columns, out, tenant)
+            return write_export_segments(
+                dataset_key, df, devices, columns, out, tenant
             )
 
-            pattern_regex = make_model_regex(model)
+        def build_file():
+            if not max_records:
+                return spool_export(write_file, compression, csv_name)
+            # Parts are rendered shard by shard on the worker processes
+            chunks = stream_chunks(stream) if df is None else iter_shards(df)
+            return spool_export_parts(
+                chunks, devices, columns, max_records, csv_name, workers, tenant
+            )
 
-            matches = df[
-                df[desc_col]
-                .astype(str)
-                .str.contains(pattern_regex, case=False, na=False, regex=True)
-            ]
-
-            for _, row in matches.iterrows():
-                mac = str(row[mac_col]).strip() if mac_col in df.columns else ""
-                sn = str(row[sn_col]).strip() if sn_col in df.columns else ""
-                fsan = str(row[fsan_col]).strip() if fsan_col in df.columns else ""
-
-                # If we truly have nothing, skip
-                if not any([mac, sn, fsan]):
-                    continue
-
-                if template:
-                    device_numbers = (
-                        template.replace("<<MAC>>", mac)
-                        .replace("<<SN>>", sn)
-                        .replace("<<FSAN>>", fsan)
-                        .replace("<<ONT_PORT>>", device.get("ONT_PORT", ""))
-                        .replace("<<ONT_PROFILE_ID>>", device.get("ONT_PROFILE_ID", ""))
-                    )
-                else:
-                    # Very generic fallback
-                    parts = []
-                    if mac:
-                        parts.append(f"MAC={mac}")
-                    if sn:
-                        parts.append(f"SN={sn}")
-                    if fsan:
-                        parts.append(f"{fsan_label}={fsan}")
-                    device_numbers = "|".join(parts)
-
-                # 🔧 Override ONT_PORT / ONT_PROFILE_ID literals for ONTs,
-                # so UI edits actually change the output even if the template
-                # hardcodes those values.
-                if dtype == "ONT":
-                    if device.get("ONT_PORT"):
-                        device_numbers = re.sub(
-                            r"ONT_PORT=[^|]*",
-                            f"ONT_PORT={device['ONT_PORT']}",
-                            device_numbers,
-                        )
-                    if device.get("ONT_PROFILE_ID"):
-                        device_numbers = re.sub(
-                            r"ONT_PROFILE_ID=[^|]*",
-                            f"ONT_PROFILE_ID={device['ONT_PROFILE_ID']}",
-                            device_numbers,
-                        )
-
-                output.write(
-                    f"{profile},{name},{device_numbers},{device['location']},UNASSIGNED\n"
-                )
-                total_records += 1
+        def build_export():
+            data, _ = cached_export(export_key, build_file)
+            return data
 
         st.download_button(
             "⬇️ Export & Download File",
-            data=output.getvalue(),
+            data=build_export,
             file_name=export_name,
-            mime="text/csv",
+            mime=EXPORT_MIME_TYPES[compression],
         )
-        st.success("✅ File is ready for download.")
-        st.info(f"ℹ️ Exported **{total_records}** records (excluding header).")
+
+        cached = EXPORT_CACHE.get(export_key) if export_key else None
+        if cached is not None:
+            st.success("✅ File is ready for download.")
+            st.info(f"ℹ️ Exported **{cached[1]}** records (excluding header).")
+        else:
+            st.info("ℹ️ The file is built when you click the button above.")
@@ -0,0 +1,108 @@
+"""
+Batch conversion of many inventory files at once, one file per worker
+process (used by the app's batch mode).
+
+Each worker runs the same pipeline as a single upload – header detection,
+classification with mappings.py (plus the company's overlay) and export –
+and hands back the finished Calix file, which can then be merged into one
+file or zipped.
+"""
+
+from concurrent.futures import as_completed
+import io
+import os
+import zipfile
+
+from calix_cache import parse_inventory_cached
+from calix_engine import (
+    EXPORT_HEADER,
+    build_devices_from_descriptions,
+    configure_devices,
+    cpu_workers,
+    export_file_name,
+    process_pool,
+    require_description,
+    spool_export,
+    unique_file_name,
+    write_export,
+)
+
+
+def convert_upload(file_name: str, data: bytes, config: dict) -> dict:
+    """
+    Convert one uploaded file (its name and raw bytes) with the settings in
+    `config` (see calix_convert). Returns a dict with 'file_name', 'data'
+    (the Calix file as UTF-8 bytes), 'total_records' and 'devices'
+    ({device name: record count}).
+    """
+    parsed, _ = parse_inventory_cached(io.BytesIO(data), file_name)
+    df = parsed["df"]
+    columns = parsed["columns"]
+    require_description(columns)
+
+    tenant = config.get("company_name", "")
+    devices = build_devices_from_descriptions(df, columns["desc"], tenant)
+    devices = configure_devices(devices, config)
+
+    spool, total_records = spool_export(
+        lambda out: write_export(df, devices, columns, out, tenant)
+    )
+    with spool:
+        data = spool.read()
+
+    return {
+        "file_name": file_name,
+        "data": data,
+        "total_records": total_records,
+        "devices": {d["device_name"]: d["count"] for d in devices},
+    }
+
+
+def convert_batch(files: list, config: dict, max_workers: int = None):
+    """
+    Convert (file_name, data) pairs in a pool of worker processes, one per
+    core by default. Yields (position, result) as each file finishes, where
+    position is the file's index in `files`; a failed file's result is a
+    dict with 'file_name' and 'error'.
+    """
+    max_workers = min(max_workers or cpu_workers(), len(files)) or 1
+
+    with process_pool(max_workers) as pool:
+        futures = {
+            pool.submit(convert_upload, file_name, data, config): position
+            for position, (file_name, data) in enumerate(files)
+        }
+        for future in as_completed(futures):
+            position = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:  # keep going; report every bad file
+                result = {"file_name": files[position][0], "error": str(exc)}
+            yield position, result
+
+
+def merge_exports(results: list) -> bytes:
+    """
+    One Calix file from several: a single header, then every file's records
+    in the order of `results`.
+    """
+    header = EXPORT_HEADER.encode("utf-8")
+    parts = [header]
+    for result in results:
+        parts.append(result["data"][len(header) :])
+    return b"".join(parts)
+
+
+def zip_exports(results: list, company_name: str = "") -> bytes:
+    """
+    A zip with one Calix file per input, named after the company and the
+    input file.
+    """
+    buffer = io.BytesIO()
+    used_names = set()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            stem = os.path.splitext(result["file_name"])[0]
+            name = export_file_name(f"{company_name} {stem}".strip())
+            archive.writestr(unique_file_name(name, used_names), result["data"])
+    return buffer.getvalue()
@@ -0,0 +1,511 @@
+"""
+Caches for parsed inventories and finished exports.
+
+Streamlit reruns the app script on every widget change and runs each
+browser session in its own thread, but imported modules live for the whole
+server process. Caches kept here are therefore shared by every session.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
+
+import pandas as pd
+
+from calix_engine import (
+    EXPORT_HEADER,
+    MATCHED_MODEL_COL,
+    detect_layout,
+    ensure_labels,
+    export_lines,
+    find_columns,
+    header_from_row,
+    label_models,
+    match_layout,
+    read_inventory,
+    read_sample,
+    role_dtypes,
+    tenant_registry,
+)
+
+# Optional: pyarrow (installed with Streamlit) for the on-disk Parquet cache
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Memory budget for parsed uploads kept in this process
+PARSE_CACHE_MAX_BYTES = int(os.environ.get("CALIX_PARSE_CACHE_MB", "512")) * 2**20
+
+# Memory budget for finished export files kept in this process
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("CALIX_EXPORT_CACHE_MB", "256")) * 2**20
+
+# Memory budget for per-device export segments kept in this process
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("CALIX_SEGMENT_CACHE_MB", "256")) * 2**20
+
+# On-disk cache of parsed + classified inventories (0 MB turns it off)
+DISK_CACHE_DIR = Path(
+    os.environ.get(
+        "CALIX_CACHE_DIR",
+        Path.home() / ".cache" / "calix-inventory-converter",
+    )
+)
+DISK_CACHE_MAX_BYTES = int(os.environ.get("CALIX_DISK_CACHE_MB", "2048")) * 2**20
+
+# Remembered file layouts (see LayoutIndex); the oldest are dropped beyond this
+LAYOUT_INDEX_PATH = Path(
+    os.environ.get("CALIX_LAYOUT_INDEX", DISK_CACHE_DIR / "layouts.json")
+)
+LAYOUT_INDEX_MAX_ENTRIES = 1000
+
+
+def file_digest(file, block_size: int = 2**20) -> str:
+    """
+    SHA-256 of a file's contents. `file` can be a path or a file-like
+    object; file-like objects are rewound afterwards.
+    """
+    digest = hashlib.sha256()
+    if hasattr(file, "read"):
+        file.seek(0)
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+        file.seek(0)
+    else:
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class MemoryCache:
+    """
+    Thread-safe LRU mapping that evicts the least recently used values once
+    their sizes (in bytes, given to put) add up to more than `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key: str, value, size: int) -> None:
+        if size > self.max_bytes:
+            return  # would evict everything else and still not fit
+
+        with self._lock:
+            if key in self._entries:
+                self.used_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.used_bytes -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+
+class ParseCache(MemoryCache):
+    """
+    Parsed inventories keyed by content hash, sized by their DataFrames.
+
+    An entry is a dict with 'df', 'sample', 'header_row_idx', 'header' and
+    'columns' (see parse_inventory). get() hands out a shallow copy of the
+    DataFrame, so a session adding columns never changes the cached one.
+    """
+
+    def get(self, key: str):
+        entry = super().get(key)
+        if entry is None:
+            return None
+        return {**entry, "df": entry["df"].copy(deep=False)}
+
+    def put(self, key: str, entry: dict) -> None:
+        size = int(entry["df"].memory_usage(index=True, deep=True).sum())
+        super().put(key, {**entry, "df": entry["df"].copy(deep=False)}, size)
+
+
+class DiskCache:
+    """
+    Parsed + classified inventories as Parquet files in `directory`, read
+    back memory-mapped instead of re-parsing the CSV/XLSX.
+
+    Files are named by content alone; rows labelled with other mappings
+    are relabelled after loading (see parse_inventory_cached). Once the
+    directory holds more than `max_bytes`, the least recently used files
+    are removed.
+    """
+
+    SUFFIX = ".parquet"
+
+    # Bumped when the stored layout changes; other formats count as misses
+    FORMAT = 2
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return pq is not None and self.max_bytes > 0
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / f"{key}{self.SUFFIX}"
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        path = self.path_for(key)
+        try:
+            table = pq.read_table(path, memory_map=True)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None
+
+        meta = json.loads(table.schema.metadata[b"calix"])
+        if meta.get("format") != self.FORMAT:
+            return None
+        df = table.to_pandas()
+        df.columns = pd.Index(meta["df_columns"])
+        header = pd.Index(meta["header"])
+        return {
+            "df": df,
+            "sample": pd.DataFrame(meta["sample"], dtype=str),
+            "header_row_idx": meta["header_row_idx"],
+            "header": header,
+            "columns": find_columns(header),
+        }
+
+    def put(self, key: str, entry: dict) -> None:
+        """
+        Store an entry. A write that fails (directory not writable, disk
+        full, ...) only leaves the entry uncached.
+        """
+        if not self.enabled:
+            return
+
+        # Parquet needs unique string column names; the real ones go in the
+        # metadata (headers can repeat or be blank)
+        df = entry["df"]
+        stored = df.set_axis([str(i) for i in range(df.shape[1])], axis=1)
+        sample = entry["sample"]
+        meta = {
+            "format": self.FORMAT,
+            "header": [None if pd.isna(h) else h for h in entry["header"]],
+            "df_columns": [None if pd.isna(c) else c for c in df.columns],
+            "header_row_idx": int(entry["header_row_idx"]),
+            "sample": sample.astype(object)
+            .where(sample.notna(), None)
+            .values.tolist(),
+        }
+
+        tmp_path = None
+        try:
+            table = pa.Table.from_pandas(stored, preserve_index=False)
+            table = table.replace_schema_metadata(
+                {**(table.schema.metadata or {}), b"calix": json.dumps(meta)}
+            )
+
+            # Write to a temp file first so readers never see a partial file
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            os.close(fd)
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, self.path_for(key))
+        except (OSError, ValueError, pa.ArrowException):
+            return  # still parsed, just not cached
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Drop the least recently used entries until the directory fits in
+        max_bytes.
+        """
+        files = []
+        for path in self.directory.glob(f"*{self.SUFFIX}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # another process got there first
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        used = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if used <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            used -= size
+
+
+class LayoutIndex:
+    """
+    Layout profiles (see detect_layout) of the files seen so far, keyed by
+    header signature and kept in a JSON file, so a vendor's monthly file
+    with a known layout skips header and column detection.
+
+    Only new layouts are written (to a temp file first, so readers never
+    see a partial file). Changes made by other processes are picked up
+    when the file's mtime moves.
+    """
+
+    def __init__(self, path: Path, max_entries: int):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._profiles = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _reload(self) -> None:
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._profiles = json.load(f)
+        except (OSError, ValueError):
+            return  # unreadable: start over, it is only a cache
+        self._mtime = mtime
+
+    def get(self, signature: str):
+        with self._lock:
+            self._reload()
+            return self._profiles.get(signature)
+
+    def put(self, profile: dict) -> None:
+        with self._lock:
+            self._reload()
+            self._profiles[profile["signature"]] = profile
+            while len(self._profiles) > self.max_entries:
+                del self._profiles[next(iter(self._profiles))]  # oldest first
+
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(self._profiles, f)
+                os.replace(tmp_path, self.path)
+                self._mtime = self.path.stat().st_mtime_ns
+            except OSError:
+                pass  # still remembered in this process
+
+
+PARSE_CACHE = ParseCache(PARSE_CACHE_MAX_BYTES)
+DISK_CACHE = DiskCache(DISK_CACHE_DIR, DISK_CACHE_MAX_BYTES)
+EXPORT_CACHE = MemoryCache(EXPORT_CACHE_MAX_BYTES)
+SEGMENT_CACHE = MemoryCache(SEGMENT_CACHE_MAX_BYTES)
+LAYOUT_INDEX = LayoutIndex(LAYOUT_INDEX_PATH, LAYOUT_INDEX_MAX_ENTRIES)
+
+
+def inventory_layout(file, file_name: str) -> tuple:
+    """
+    Read the first rows of a file and find its layout: a profile from
+    LAYOUT_INDEX when one of the rows is a known header row, otherwise
+    detect_layout (the new profile is remembered). Returns (sample,
+    layout, known), where the layout profile also has 'header', the
+    header row's column names.
+    """
+    sample = read_sample(file, file_name)
+    layout = match_layout(sample, file_name, LAYOUT_INDEX.get)
+    known = layout is not None
+    if not known:
+        layout = detect_layout(sample, file_name)
+        LAYOUT_INDEX.put(layout)
+    header = header_from_row(sample, layout["header_row_idx"])
+    return sample, {**layout, "header": header}, known
+
+
+def parse_inventory(file, file_name: str) -> dict:
+    """
+    Find the file's layout (see inventory_layout), parse the whole file and
+    label every row with its model. Only the description/MAC/SN/FSAN
+    columns are read, straight into compact dtypes (see role_dtype).
+    Returns the entry dict stored by the caches.
+    """
+    sample, layout, _ = inventory_layout(file, file_name)
+    header = layout["header"]
+    columns = layout["columns"]
+    df = read_inventory(
+        file,
+        file_name,
+        layout["header_row_idx"],
+        header,
+        layout["usecols"],
+        role_dtypes(header, columns),
+    )
+    if columns["desc"]:
+        label_models(df, columns["desc"])
+    return {
+        "df": df,
+        "sample": sample,
+        "header_row_idx": layout["header_row_idx"],
+        "header": header,
+        "columns": columns,
+    }
+
+
+def parse_inventory_cached(file, file_name: str):
+    """
+    parse_inventory through PARSE_CACHE, then DISK_CACHE, keyed by the
+    file's content hash and type. Entries labelled with other mappings are
+    relabelled instead of parsed again (see ensure_labels). Returns
+    (entry, cache_hit); the entry's 'dataset_key' identifies the file for
+    export_cache_key.
+    """
+    suffix = os.path.splitext(str(file_name))[1].lower().lstrip(".")
+    key = f"{file_digest(file)}-{suffix}"
+
+    entry = PARSE_CACHE.get(key)
+    in_memory = cache_hit = entry is not None
+    if not cache_hit:
+        entry = DISK_CACHE.get(key)
+        cache_hit = entry is not None
+        if not cache_hit:
+            entry = parse_inventory(file, file_name)
+            DISK_CACHE.put(key, entry)
+
+    relabelled = False
+    desc_col = entry["columns"]["desc"]
+    if desc_col:
+        models = entry["df"][MATCHED_MODEL_COL].cat.categories
+        labels = ensure_labels(entry["df"], desc_col)
+        relabelled = not labels.cat.categories.equals(models)
+    if not in_memory or relabelled:
+        PARSE_CACHE.put(key, entry)
+
+    return {**entry, "dataset_key": key}, cache_hit
+
+
+# Device fields that change the exported file (not 'count')
+EXPORT_DEVICE_FIELDS = (
+    "device_name",
+    "model_name",
+    "device_type",
+    "location",
+    "ONT_PORT",
+    "ONT_PROFILE_ID",
+    "exclude_mac_sn",
+)
+
+
+def device_settings(device: dict) -> list:
+    """
+    The values of a device's EXPORT_DEVICE_FIELDS, in order.
+    """
+    return [device.get(field) for field in EXPORT_DEVICE_FIELDS]
+
+
+def export_cache_key(
+    dataset_key: str,
+    devices: list,
+    compression: str = None,
+    max_records: int = 0,
+    tenant: str = "",
+    arcname: str = "export.csv",
+) -> str:
+    """
+    Key for one export: the dataset, every device's export settings (in
+    order), the output format (compression, part size, name of the file in
+    a zip) and the version of the tenant's mappings (see tenant_registry).
+    """
+    config = [device_settings(device) for device in devices]
+    version = tenant_registry(tenant)["version"]
+    payload = json.dumps(
+        [dataset_key, config, compression, max_records, arcname, version]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def segment_cache_key(dataset_key: str, device: dict, version: str) -> str:
+    """
+    Key for one device's export lines: the dataset, that device's settings
+    and the mappings version (its template and which rows it owns).
+    """
+    payload = json.dumps([dataset_key, device_settings(device), version])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def device_segment(
+    dataset_key: str, df, device: dict, columns: dict, registry: dict, labels
+) -> tuple:
+    """
+    (lines, record_count) for one device, from SEGMENT_CACHE when that
+    device's settings have not changed since it was last built.
+    """
+    key = segment_cache_key(dataset_key, device, registry["version"])
+    segment = SEGMENT_CACHE.get(key)
+    if segment is None:
+        lines = export_lines(df, device, columns, registry, labels)
+        segment = ("".join(lines), len(lines))
+        SEGMENT_CACHE.put(key, segment, len(segment[0]))
+    return segment
+
+
+def write_export_segments(
+    dataset_key: str, df, devices: list, columns: dict, out, tenant: str = ""
+) -> int:
+    """
+    Like write_export, but assembled from cached per-device segments, so
+    changing one device's settings only rebuilds that device's lines.
+    Returns the number of records.
+    """
+    registry = tenant_registry(tenant)
+    labels = ensure_labels(df, columns["desc"], registry)
+
+    out.write(EXPORT_HEADER)
+
+    total_records = 0
+    for device in devices:
+        lines, count = device_segment(
+            dataset_key, df, device, columns, registry, labels
+        )
+        out.write(lines)
+        total_records += count
+
+    return total_records
+
+
+def cached_export(key, build) -> tuple:
+    """
+    Return (data, total_records) for an export, calling build() to make it
+    only when EXPORT_CACHE does not have `key` yet. build() returns a
+    spooled file and the record count (see spool_export and
+    spool_export_parts); the key must cover its output format too (see
+    export_cache_key). A key of None skips the cache.
+    """
+    if key is not None:
+        cached = EXPORT_CACHE.get(key)
+        if cached is not None:
+            return cached
+
+    spool, total_records = build()
+    with spool:
+        data = spool.read()
+
+    if key is not None:
+        EXPORT_CACHE.put(key, (data, total_records), len(data))
+    return data, total_records
@@ -0,0 +1,402 @@
+"""
+Headless batch converter – same engine as the Streamlit app, no browser.
+
+Usage:
+    python calix_convert.py INPUT [INPUT ...] [-o OUTPUT_DIR] [-c CONFIG.json]
+                            [--chunksize N] [-j JOBS] [-w WORKERS]
+                            [--compress {gzip,zip}] [--max-records N]
+
+INPUT can be a .csv/.xlsx file or a directory (all .csv/.xlsx files in it
+are converted). Each input gets its own Calix import file in OUTPUT_DIR;
+inputs that would get the same name (e.g. d1/site.csv and d2/site.csv)
+get '_2', '_3', ... added.
+
+With --chunksize N, inputs are streamed N rows at a time instead of being
+loaded whole, so very large files convert in bounded memory. With -j JOBS,
+up to JOBS files are converted at once in separate processes. With
+-w WORKERS, each file is split into row shards that are classified and
+rendered on WORKERS cores (same output as a single core). With --compress,
+each Calix file is written gzip- or zip-compressed as it is generated. With
+--max-records N, each Calix file becomes a zip of part files of at most N
+records (each with a header row) plus a manifest of records per device
+(so it cannot be combined with --compress).
+
+The optional JSON config holds what an operator would type into the UI.
+The company name also picks the company's mapping overlay, if there is one
+(see tenant_registry in calix_engine):
+
+    {
+        "company_name": "Acme ISP",
+        "default_location": "WAREHOUSE",
+        "devices": {
+            "GS4227": {"location": "TRUCK 7", "ONT_PORT": "G1",
+                       "ONT_PROFILE_ID": "GS4227", "exclude_mac_sn": false},
+            "SFP-XGS": {"skip": true}
+        }
+    }
+"""
+
+import argparse
+from concurrent.futures import as_completed
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+
+from calix_cache import inventory_layout, parse_inventory_cached
+from calix_engine import (
+    EXPORT_COMPRESSIONS,
+    MAPPINGS_PATH,
+    build_devices_from_descriptions,
+    compressed_file_name,
+    configure_devices,
+    cpu_workers,
+    devices_from_counts,
+    export_file_name,
+    export_writer,
+    iter_chunks,
+    iter_shards,
+    overlay_path,
+    process_pool,
+    require_description,
+    scan_model_counts,
+    tenant_error,
+    tenant_registry,
+    unique_file_name,
+    write_export,
+    write_export_chunks,
+    write_export_parts,
+)
+
+INPUT_SUFFIXES = (".csv", ".xlsx")
+
+
+def collect_inputs(paths) -> list:
+    """
+    Expand the command-line inputs into a sorted list of inventory files.
+    """
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(
+                sorted(
+                    p
+                    for p in path.iterdir()
+                    if p.is_file() and p.suffix.lower() in INPUT_SUFFIXES
+                )
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def load_config(path) -> dict:
+    """
+    Read the JSON config file (an empty config when no path is given).
+    """
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def output_paths(files: list, output_dir: Path, config: dict) -> list:
+    """
+    The Calix file path for each input, in order: named after the company
+    and the input file, and unique within the run.
+    """
+    company_name = config.get("company_name", "")
+    used_names = set()
+    return [
+        output_dir
+        / unique_file_name(
+            export_file_name(f"{company_name} {path.stem}".strip()), used_names
+        )
+        for path in files
+    ]
+
+
+def write_output(
+    output_path: Path, write, compression: str = None, write_parts=None
+) -> tuple:
+    """
+    Stream write(out) into the Calix file at `output_path`, compressed as
+    asked (see export_writer), or, when given, write_parts(f) into a zip of
+    part files instead (see write_export_parts). The file is written under
+    a temporary name and only renamed once complete, so a failed conversion
+    leaves nothing behind. Returns (path written, total_records).
+    """
+    if write_parts:
+        final_path = output_path.with_suffix(".zip")
+    else:
+        final_path = output_path.with_name(
+            compressed_file_name(output_path.name, compression)
+        )
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=final_path.parent, prefix=f".{final_path.name}.", suffix=".tmp"
+    )
+    try:
+        with open(fd, "wb") as f:
+            if write_parts:
+                total_records = write_parts(f)
+            else:
+                with export_writer(f, compression, arcname=output_path.name) as out:
+                    total_records = write(out)
+        os.replace(tmp_path, final_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return final_path, total_records
+
+
+def convert_file(
+    path: Path,
+    output_path: Path,
+    config: dict,
+    workers: int = 1,
+    compression: str = None,
+    max_records: int = 0,
+) -> tuple:
+    """
+    Convert one inventory file held in memory into the Calix file at
+    `output_path` (see write_output). Files converted before are loaded
+    from the on-disk parse cache. Returns (path written, total_records).
+    """
+    tenant = config.get("company_name", "")
+    parsed, _ = parse_inventory_cached(path, path.name)
+    df = parsed["df"]
+    columns = parsed["columns"]
+    require_description(columns)
+
+    devices = build_devices_from_descriptions(df, columns["desc"], tenant)
+    devices = configure_devices(devices, config)
+
+    def write(out):
+        if workers > 1:
+            return write_export_chunks(
+                iter_shards(df), devices, columns, out, workers, tenant
+            )
+        return write_export(df, devices, columns, out, tenant)
+
+    def write_parts(f):
+        return write_export_parts(
+            iter_shards(df),
+            devices,
+            columns,
+            f,
+            max_records,
+            output_path.name,
+            workers,
+            tenant,
+        )
+
+    # Stream each device's lines straight to disk
+    return write_output(
+        output_path, write, compression, write_parts if max_records else None
+    )
+
+
+def convert_file_streaming(
+    path: Path,
+    output_path: Path,
+    config: dict,
+    chunksize: int,
+    workers: int = 1,
+    compression: str = None,
+    max_records: int = 0,
+) -> tuple:
+    """
+    Convert one file without ever loading it whole: a first pass over the
+    chunks counts devices, a second pass writes the export.
+    Returns (path written, total_records).
+    """
+    tenant = config.get("company_name", "")
+    _, layout, _ = inventory_layout(path, path.name)
+    columns = layout["columns"]
+    require_description(columns)
+
+    def chunks():
+        return iter_chunks(
+            path,
+            path.name,
+            layout["header_row_idx"],
+            layout["header"],
+            chunksize,
+            usecols=layout["usecols"],
+        )
+
+    model_counts, _ = scan_model_counts(
+        chunks(), columns, max_workers=workers, tenant=tenant
+    )
+    devices = devices_from_counts(model_counts, tenant_registry(tenant))
+    devices = configure_devices(devices, config)
+
+    def write(out):
+        return write_export_chunks(chunks(), devices, columns, out, workers, tenant)
+
+    def write_parts(f):
+        return write_export_parts(
+            chunks(),
+            devices,
+            columns,
+            f,
+            max_records,
+            output_path.name,
+            workers,
+            tenant,
+        )
+
+    return write_output(
+        output_path, write, compression, write_parts if max_records else None
+    )
+
+
+def convert_path(path: Path, output_path: Path, config: dict, options: dict):
+    """
+    convert_file, or convert_file_streaming when a chunk size is given.
+    `options` holds 'chunksize', 'workers', 'compression' and 'max_records'.
+    """
+    output = {
+        "workers": options.get("workers", 1),
+        "compression": options.get("compression"),
+        "max_records": options.get("max_records", 0),
+    }
+    if options.get("chunksize"):
+        return convert_file_streaming(
+            path, output_path, config, options["chunksize"], **output
+        )
+    return convert_file(path, output_path, config, **output)
+
+
+def convert_all(files: list, output_dir: Path, config: dict, options: dict, jobs: int):
+    """
+    Convert every file, `jobs` at a time in worker processes when jobs > 1.
+    Yields (path, (output_path, total_records) or the exception raised).
+    """
+    paths = list(zip(files, output_paths(files, output_dir, config)))
+    if jobs <= 1 or len(files) <= 1:
+        for path, output_path in paths:
+            try:
+                yield path, convert_path(path, output_path, config, options)
+            except Exception as exc:  # keep going; report every bad file
+                yield path, exc
+        return
+
+    with process_pool(min(jobs, len(files))) as pool:
+        futures = {
+            pool.submit(convert_path, path, output_path, config, options): path
+            for path, output_path in paths
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as exc:
+                yield futures[future], exc
+
+
+def non_negative_int(text: str) -> int:
+    """
+    argparse type for counts where 0 means "off" or "all".
+    """
+    value = int(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, not {value}")
+    return value
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="calix-convert",
+        description="Convert ISP inventory exports into Calix-ready import files.",
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help=".csv/.xlsx files or directories of them"
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        default=".",
+        help="where to write the Calix files (default: current directory)",
+    )
+    parser.add_argument(
+        "-c", "--config", help="JSON file with company name and per-model overrides"
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="stream inputs this many rows at a time (for very large files)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="convert this many files at once (0 = one per CPU core)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="split each file into row shards converted on this many cores "
+        "(0 = all)",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=[c for c in EXPORT_COMPRESSIONS if c],
+        help="write each Calix file gzip- or zip-compressed",
+    )
+    parser.add_argument(
+        "--max-records",
+        type=non_negative_int,
+        default=0,
+        help="split each Calix file into zipped parts of at most N records "
+        "(0 = one file; not with --compress)",
+    )
+    args = parser.parse_args(argv)
+    if args.max_records and args.compress:
+        parser.error("--compress cannot be combined with --max-records")
+
+    config = load_config(args.config)
+
+    company_name = config.get("company_name", "")
+    sources = [MAPPINGS_PATH.name]
+    if overlay_path(company_name):
+        sources.append(overlay_path(company_name).name)
+    for problem in tenant_registry(company_name)["problems"]:
+        print(f"⚠️ {' + '.join(sources)}: {problem}", file=sys.stderr)
+    if tenant_error(company_name):
+        print(f"❌ overlay not used: {tenant_error(company_name)}", file=sys.stderr)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    files = collect_inputs(args.inputs)
+    if not files:
+        print("No .csv/.xlsx inputs found.", file=sys.stderr)
+        return 1
+
+    jobs = args.jobs or cpu_workers()
+    options = {
+        "chunksize": args.chunksize,
+        "workers": args.workers or cpu_workers(),
+        "compression": args.compress,
+        "max_records": args.max_records,
+    }
+
+    failures = 0
+    for path, outcome in convert_all(files, output_dir, config, options, jobs):
+        if isinstance(outcome, Exception):
+            failures += 1
+            print(f"❌ {path}: {outcome}", file=sys.stderr)
+            continue
+        output_path, total_records = outcome
+        print(f"✅ {path} → {output_path} ({total_records} records)")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
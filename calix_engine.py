@@ -0,0 +1,1936 @@
+"""
+Conversion engine shared by the Streamlit app (calix_app.py) and the
+command-line converter (calix_convert.py).
+
+Nothing in here depends on Streamlit: it reads an inventory file, finds the
+header row and key columns, labels each row with a known model from
+mappings.py and writes the Calix import file.
+"""
+
+import ast
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, closing, contextmanager
+from datetime import datetime
+from functools import lru_cache
+import gzip
+import hashlib
+import io
+from itertools import islice
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import zipfile
+
+import numpy as np
+from openpyxl import load_workbook
+import pandas as pd
+
+# Optional: python-calamine parses whole .xlsx sheets much faster than openpyxl
+try:
+    import python_calamine  # noqa: F401
+
+    XLSX_FAST_ENGINE = "calamine"
+except ImportError:
+    XLSX_FAST_ENGINE = None
+
+# Optional: pyarrow (installed with Streamlit) stores identifier columns as
+# Arrow strings instead of one Python object per cell
+try:
+    import pyarrow  # noqa: F401
+
+    ID_DTYPE = pd.StringDtype("pyarrow")
+except ImportError:
+    ID_DTYPE = str
+
+# Optional: PyYAML for mappings kept in a .yaml file
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+# --- Reading & header detection ----------------------------------------------
+
+# Only the first rows are searched for the header row
+HEADER_SCAN_ROWS = 10
+
+# Rows per chunk when streaming a large CSV
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def auto_detect_header_row(df: pd.DataFrame) -> int:
+    """
+    Try to find the row that contains header names like 'Item Description' / 'Description'
+    and 'FSAN'. Look at the first HEADER_SCAN_ROWS rows. Fallback to row 0.
+    """
+    max_scan_rows = min(HEADER_SCAN_ROWS, len(df))
+
+    # Pass 1 – look for a row that has BOTH description & FSAN-ish cells.
+    for idx in range(max_scan_rows):
+        row = df.iloc[idx]
+        cells = [str(x).strip().lower() for x in row]
+        has_desc = any("description" in c for c in cells)
+        has_fsan = any("fsan" in c for c in cells)
+        if has_desc and has_fsan:
+            return idx
+
+    # Pass 2 – any row with a description-ish header.
+    for idx in range(max_scan_rows):
+        row = df.iloc[idx]
+        cells = [str(x).strip().lower() for x in row]
+        if any("description" in c for c in cells):
+            return idx
+
+    # Fallback
+    return 0
+
+
+def header_from_row(raw_df: pd.DataFrame, header_row_idx: int) -> pd.Index:
+    """
+    Column names taken from one row of a raw frame, stripped.
+    """
+    return pd.Index(raw_df.iloc[header_row_idx].astype(str).str.strip())
+
+
+def is_csv(file_name: str) -> bool:
+    return str(file_name).lower().endswith(".csv")
+
+
+def xlsx_cell_text(value):
+    """
+    An .xlsx cell value as text, the way read_excel(dtype=str) would give it:
+    empty cells are NaN and whole-number floats lose their '.0'.
+    """
+    if value is None or value == "":
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def iter_xlsx_rows(file):
+    """
+    Lazily yield the first sheet's rows as lists of text (NaN for empty
+    cells). Uses openpyxl's read-only mode, which streams the sheet instead
+    of building the workbook's cell object model.
+
+    Blank rows count as rows (so row indexes match read_excel), except at
+    the end of the sheet, which read_excel trims as well.
+    """
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        blank_rows = []
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            cells = [xlsx_cell_text(value) for value in row]
+            if not any(isinstance(cell, str) for cell in cells):
+                blank_rows.append(cells)
+                continue
+            yield from blank_rows
+            blank_rows = []
+            yield cells
+    finally:
+        workbook.close()
+
+
+def rows_to_frame(rows: list, header, usecols=None) -> pd.DataFrame:
+    """
+    Build a text DataFrame from row lists, padded/trimmed to the header width.
+    With `usecols` (column positions), only those columns are kept.
+    """
+    if usecols is None:
+        width = len(header)
+        rows = [row[:width] + [np.nan] * (width - len(row)) for row in rows]
+        return pd.DataFrame(rows, columns=header, dtype=str)
+
+    rows = [[row[i] if i < len(row) else np.nan for i in usecols] for row in rows]
+    return pd.DataFrame(rows, columns=header[usecols], dtype=str)
+
+
+def read_sample(file, file_name: str, nrows: int = HEADER_SCAN_ROWS) -> pd.DataFrame:
+    """
+    Read only the first `nrows` rows of a .csv or .xlsx with no header –
+    enough for auto_detect_header_row and the raw preview. `file` can be a
+    path or a file-like object (e.g. a Streamlit upload); file-like objects
+    are rewound afterwards.
+    """
+    if is_csv(file_name):
+        sample = pd.read_csv(file, header=None, nrows=nrows, dtype=str)
+    else:
+        with closing(iter_xlsx_rows(file)) as rows:
+            sample = pd.DataFrame(list(islice(rows, nrows)), dtype=str)
+    if hasattr(file, "seek"):
+        file.seek(0)
+    return sample
+
+
+def read_inventory(
+    file, file_name: str, header_row_idx: int, header, usecols=None, dtypes=None
+) -> pd.DataFrame:
+    """
+    Parse the data rows below the header row in a single pass, every cell
+    as text (so IDs such as MACs keep their leading zeros). Columns are
+    named by `header` (see header_from_row). With `usecols` (sorted column
+    positions, see role_positions) the other columns are never stored.
+
+    `dtypes` ({column position: dtype} for every column read, see
+    role_dtypes) stores those columns in text-based dtypes other than str:
+    CSV columns are parsed straight into them, .xlsx columns converted
+    after reading.
+
+    .xlsx files use the calamine engine when it is installed, otherwise
+    openpyxl's read-only row stream.
+    """
+    if hasattr(file, "seek"):
+        file.seek(0)
+    if is_csv(file_name):
+        df = pd.read_csv(
+            file, header=header_row_idx, dtype=dtypes or str, usecols=usecols
+        )
+    elif XLSX_FAST_ENGINE:
+        df = pd.read_excel(
+            file,
+            header=header_row_idx,
+            dtype=str,
+            usecols=usecols,
+            engine=XLSX_FAST_ENGINE,
+        )
+    else:
+        chunks = list(iter_xlsx_chunks(file, header_row_idx, header, usecols=usecols))
+        if not chunks:
+            return rows_to_frame([], header, usecols)
+        df = pd.concat(chunks, ignore_index=True)
+    df.columns = header if usecols is None else header[usecols]
+    if dtypes and not is_csv(file_name):
+        positions = list(range(len(header)) if usecols is None else usecols)
+        for position, dtype in dtypes.items():
+            i = positions.index(position)
+            df.isetitem(i, df.iloc[:, i].astype(dtype))
+    return df
+
+
+def iter_chunks(
+    file,
+    file_name: str,
+    header_row_idx: int,
+    header,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    usecols=None,
+):
+    """
+    Yield the data rows below the header row in DataFrames of at most
+    `chunksize` rows, named by `header`. The whole file is never loaded.
+    Cells are read as text, like read_inventory (and `usecols` works the
+    same way).
+    """
+    if is_csv(file_name):
+        return iter_csv_chunks(file, header_row_idx, header, chunksize, usecols)
+    return iter_xlsx_chunks(file, header_row_idx, header, chunksize, usecols)
+
+
+def iter_csv_chunks(
+    file,
+    header_row_idx: int,
+    header,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    usecols=None,
+):
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+    names = header if usecols is None else header[usecols]
+    with pd.read_csv(
+        file, header=header_row_idx, dtype=str, usecols=usecols, chunksize=chunksize
+    ) as reader:
+        for chunk in reader:
+            chunk.columns = names
+            yield chunk
+
+
+def iter_xlsx_chunks(
+    file,
+    header_row_idx: int,
+    header,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    usecols=None,
+):
+    with closing(iter_xlsx_rows(file)) as rows:
+        # Skip everything up to and including the header row
+        for _ in islice(rows, header_row_idx + 1):
+            pass
+
+        while True:
+            batch = list(islice(rows, chunksize))
+            if not batch:
+                break
+            yield rows_to_frame(batch, header, usecols)
+
+
+def require_description(columns: dict) -> None:
+    """
+    Raise ValueError when no Item Description column was found (see
+    find_columns).
+    """
+    if not columns["desc"]:
+        raise ValueError(
+            "could not detect an Item Description column "
+            "(no header contains the word 'Description')"
+        )
+
+
+def find_columns(column_names) -> dict:
+    """
+    Locate the commonly-named columns among `column_names` (e.g. df.columns).
+    Returns a dict with keys 'desc', 'mac', 'sn' and 'fsan'; a value is None
+    when not found.
+    """
+    column_names = list(column_names)
+    return {
+        "desc": next(
+            (col for col in column_names if "description" in str(col).lower()),
+            None,
+        ),
+        "mac": next(
+            (col for col in column_names if "mac" in str(col).lower()),
+            None,
+        ),
+        "sn": next(
+            (
+                col
+                for col in column_names
+                if "serial" in str(col).lower() or str(col).lower() == "sn"
+            ),
+            None,
+        ),
+        "fsan": next(
+            (col for col in column_names if "fsan" in str(col).lower()),
+            None,
+        ),
+    }
+
+
+def role_positions(header, columns: dict):
+    """
+    Sorted positions in `header` of the columns find_columns picked – the
+    only ones the conversion reads – or None (keep everything) when it
+    found none.
+    """
+    names = list(header)
+    positions = {names.index(col) for col in columns.values() if col is not None}
+    return sorted(positions) or None
+
+
+def role_dtype(role: str):
+    """
+    Compact dtype for a role column: the description (a handful of distinct
+    values over many rows) as a categorical, MAC/SN/FSAN as Arrow strings
+    when pyarrow is installed.
+    """
+    return "category" if role == "desc" else ID_DTYPE
+
+
+def role_dtypes(header, columns: dict) -> dict:
+    """
+    {position in `header`: role_dtype} for the columns find_columns picked,
+    for a typed read_inventory.
+    """
+    names = list(header)
+    dtypes = {}
+    for role, col in columns.items():
+        if col is not None:
+            # One column in two roles: the description's dtype wins
+            dtypes.setdefault(names.index(col), role_dtype(role))
+    return dtypes
+
+
+# --- Layout profiles ---------------------------------------------------------
+
+
+def header_signature(file_name: str, header_row_idx: int, header) -> str:
+    """
+    Identifies a file layout: the file type, where the header row is and
+    its (stripped) cell texts.
+    """
+    payload = json.dumps([is_csv(file_name), header_row_idx, list(map(str, header))])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def detect_layout(sample: pd.DataFrame, file_name: str) -> dict:
+    """
+    Work out a file's layout from its first rows: the header row (see
+    auto_detect_header_row) and the role columns in it. Returns a layout
+    profile: 'signature' (see header_signature), 'header_row_idx',
+    'columns' (see find_columns) and 'usecols' (see role_positions).
+    """
+    header_row_idx = auto_detect_header_row(sample)
+    header = header_from_row(sample, header_row_idx)
+    columns = find_columns(header)
+    return {
+        "signature": header_signature(file_name, header_row_idx, header),
+        "header_row_idx": header_row_idx,
+        "columns": columns,
+        "usecols": role_positions(header, columns),
+    }
+
+
+def match_layout(sample: pd.DataFrame, file_name: str, known):
+    """
+    The first sample row that is the header row of a known layout, found
+    by its signature alone: returns that layout profile, or None.
+    `known(signature)` looks up a stored profile (or returns None).
+    """
+    for header_row_idx in range(len(sample)):
+        header = header_from_row(sample, header_row_idx)
+        profile = known(header_signature(file_name, header_row_idx, header))
+        if profile is not None and profile["header_row_idx"] == header_row_idx:
+            return profile
+    return None
+
+
+# --- Row shards & worker processes -------------------------------------------
+
+
+def iter_shards(df: pd.DataFrame, shard_rows: int = DEFAULT_CHUNKSIZE):
+    """
+    Split an in-memory inventory into consecutive row shards (views), so it
+    can go through the same chunked code paths as a streamed file.
+    """
+    for start in range(0, len(df), shard_rows):
+        yield df.iloc[start : start + shard_rows]
+
+
+def cpu_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    A pool of `max_workers` worker processes, for every parallel path (row
+    shards, batch and CLI files). "spawn" starts clean workers instead of
+    forking a threaded server, so each imports this module afresh.
+    """
+    context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+def map_shards(func, shards, *args, max_workers: int = 1):
+    """
+    Yield func(shard, *args) for every shard, in shard order.
+
+    With max_workers > 1 the calls run in that many worker processes; each
+    worker imports this module once, so the compiled matcher and templates
+    are built once per worker, not per shard. Only a few shards per worker
+    are in flight at a time, so a streamed file stays in bounded memory.
+    """
+    if max_workers <= 1:
+        for shard in shards:
+            yield func(shard, *args)
+        return
+
+    with process_pool(max_workers) as pool:
+        pending = deque()
+        for shard in shards:
+            pending.append(pool.submit(func, shard, *args))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# --- Model matching ----------------------------------------------------------
+
+
+def device_profile_to_type(profile: str) -> str:
+    """
+    Map profile name from mappings.py to the friendly device_type used in the UI.
+    """
+    if profile == "ONT":
+        return "ONT"
+    if profile == "CX_ROUTER":
+        return "ROUTER"
+    if profile == "CX_MESH":
+        return "MESH"
+    if profile == "CX_SFP":
+        return "SFP"
+    # Fallback for anything else (GAM_COAX_ENDPOINT, etc.)
+    return "ENDPOINT"
+
+
+# Characters that may NOT touch a model name ("word-ish" boundary)
+MODEL_WORD_CHARS = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-"
+)
+
+# ASCII-only upper-casing keeps string positions intact
+_ASCII_UPPER = str.maketrans(
+    "abcdefghijklmnopqrstuvwxyz", "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+)
+
+
+# Below this many models one regex alternation (run in C) is faster than
+# the automaton, whose Python loop costs about the same for any number of
+# models; the regex slows down with every model added. Measured per
+# description: 36 models (mappings.py) regex 3 us vs automaton 10 us,
+# 200 models 12 us vs 10 us, 1000 models 52 us vs 8 us.
+MODEL_AUTOMATON_MIN_MODELS = 150
+
+
+class ModelMatcher:
+    """
+    Finds model names in descriptions, case-insensitively (ASCII) and with
+    "word-ish" boundaries: no letter/number/dash immediately before or
+    after a match. Overlaps resolve leftmost-longest: the match starting
+    first wins, and among those the longest one (e.g. 'GM1028H' over
+    'GM1028').
+
+    With MODEL_AUTOMATON_MIN_MODELS or more names (or automaton=True) it
+    searches with an Aho-Corasick automaton, which reads a description once
+    whatever the number of models; with fewer, with one compiled regex.
+    Both give the same result.
+    """
+
+    def __init__(self, model_names, automaton: bool = None):
+        model_names = [str(name) for name in model_names]
+        if automaton is None:
+            automaton = len(model_names) >= MODEL_AUTOMATON_MIN_MODELS
+        self.automaton = automaton
+        if not automaton:
+            self._build_regex(model_names)
+            return
+
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]  # (length, code) of names ending at each state
+        self.max_len = 0
+
+        for code, name in enumerate(model_names):
+            key = name.translate(_ASCII_UPPER)
+            state = 0
+            for ch in key:
+                if ch not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            if not self.out[state]:  # first name wins on a case-only duplicate
+                self.out[state].append((len(key), code))
+            self.max_len = max(self.max_len, len(key))
+
+        # Breadth-first pass to set failure links and inherit their outputs
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def _build_regex(self, model_names) -> None:
+        # Longer names first, so at any position the longest model wins
+        self.codes = {}
+        for code, name in enumerate(model_names):
+            self.codes.setdefault(name.translate(_ASCII_UPPER), code)
+        alternation = "|".join(
+            re.escape(name) for name in sorted(self.codes, key=len, reverse=True)
+        )
+        self.pattern = re.compile(
+            rf"(?<![A-Za-z0-9-])({alternation})(?![A-Za-z0-9-])",
+            re.IGNORECASE | re.ASCII,
+        )
+
+    def search(self, text: str) -> int:
+        """
+        Code (position in model_names) of the leftmost-longest model found
+        in `text`, or -1.
+        """
+        if not self.automaton:
+            if not self.codes:
+                return -1
+            m = self.pattern.search(text)
+            return self.codes[m.group(1).translate(_ASCII_UPPER)] if m else -1
+
+        text = text.translate(_ASCII_UPPER)
+        goto, fail, out = self.goto, self.fail, self.out
+        best_start, best_len, best_code = len(text), 0, -1
+        state = 0
+
+        for end, ch in enumerate(text, start=1):
+            # Nothing ending here or later can start before the best match
+            if end - self.max_len > best_start:
+                break
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+
+            for length, code in out[state]:
+                start = end - length
+                if start > best_start or (start == best_start and length <= best_len):
+                    continue
+                if start and text[start - 1] in MODEL_WORD_CHARS:
+                    continue
+                if end < len(text) and text[end] in MODEL_WORD_CHARS:
+                    continue
+                best_start, best_len, best_code = start, length, code
+
+        return best_code
+
+
+# Per-row model label, computed once per upload and reused by Step 2 and Step 3
+MATCHED_MODEL_COL = "matched_model"
+
+# Distinct descriptions remembered by match_description (per process)
+MODEL_MEMO_SIZE = 65_536
+
+
+@lru_cache(maxsize=MODEL_MEMO_SIZE)
+def match_description(description: str, matcher) -> int:
+    """
+    Position in the registry's 'models' of the first known model mentioned
+    in one description, or -1. Memoized (LRU) per matcher, so descriptions
+    already seen – also in earlier uploads – are not matched again, and
+    results from older mappings are never reused.
+    """
+    return matcher.search(description)
+
+
+def match_models(desc_series: pd.Series, registry: dict = None) -> pd.Series:
+    """
+    Label every description with the first known model it mentions.
+    Rows with no known model get NaN.
+
+    Inventories repeat a handful of descriptions over many rows, so each
+    distinct description is matched once (pd.factorize) and the result is
+    broadcast back to the rows by integer code. Returns a categorical over
+    the registry's models (the current mappings by default).
+    """
+    registry = registry or current_registry()
+    matcher = registry["matcher"]
+
+    codes, uniques = pd.factorize(desc_series)
+    unique_models = np.fromiter(
+        (match_description(str(desc), matcher) for desc in uniques),
+        dtype=np.int64,
+        count=len(uniques),
+    )
+    # Missing descriptions have code -1, which picks the trailing -1
+    row_models = np.append(unique_models, -1)[codes]
+    return pd.Series(
+        pd.Categorical.from_codes(row_models, categories=registry["models"]),
+        index=desc_series.index,
+    )
+
+
+def label_models(df: pd.DataFrame, desc_col: str, registry: dict = None) -> None:
+    """
+    Store the matched model for every row in df[MATCHED_MODEL_COL].
+    Each row gets at most one model, so Step 2 counts and Step 3 export
+    rows always agree.
+    """
+    registry = registry or current_registry()
+    df[MATCHED_MODEL_COL] = match_models(df[desc_col], registry)
+
+
+def ensure_labels(df: pd.DataFrame, desc_col: str, registry: dict = None) -> pd.Series:
+    """
+    label_models, unless df already has labels over the same models (they
+    are redone after the mappings were reloaded, or for a tenant overlay
+    that adds models). Returns the labels: a caller keeps a consistent set
+    even if another session relabels the same cached df meanwhile.
+    """
+    registry = registry or current_registry()
+    labels = df.get(MATCHED_MODEL_COL)
+    # Labels depend on the model list only, which their categories record
+    if (
+        not isinstance(getattr(labels, "dtype", None), pd.CategoricalDtype)
+        or list(labels.cat.categories) != registry["models"]
+    ):
+        labels = match_models(df[desc_col], registry)
+        df[MATCHED_MODEL_COL] = labels
+    return labels
+
+
+# --- Template engine ---------------------------------------------------------
+
+TEMPLATE_PLACEHOLDER_RE = re.compile(r"<<(MAC|SN|FSAN|ONT_PORT|ONT_PROFILE_ID)>>")
+
+
+def compile_template(template: str) -> list:
+    """
+    Parse a device_numbers template into its "|"-separated fields.
+
+    Each field is (key, "=", pieces), where pieces is the value split on
+    placeholders: even positions are literal text, odd positions are slot
+    names such as 'MAC' or 'ONT_PORT'.
+    """
+    fields = []
+    for field in template.split("|"):
+        if "=" in field:
+            key, eq, value = field.partition("=")
+        else:
+            key, eq, value = "", "", field
+        fields.append((key, eq, TEMPLATE_PLACEHOLDER_RE.split(value)))
+    return fields
+
+
+def template_field_value(compiled: list, key: str) -> str:
+    """
+    Text of the first field named `key` in a compiled template ("" if absent).
+    """
+    for field_key, _, pieces in compiled:
+        if field_key == key:
+            return "".join(
+                f"<<{piece}>>" if i % 2 else piece for i, piece in enumerate(pieces)
+            )
+    return ""
+
+
+def bind_template(compiled: list, constants: dict, overrides: dict = None) -> list:
+    """
+    Resolve a compiled template for one device, once.
+
+    Fields named in `overrides` get that value verbatim; slots named in
+    `constants` are filled in. The result alternates literal text (even
+    positions) and per-row slot names (odd positions), ready for
+    render_template.
+    """
+    plan = [""]
+    for i, (key, eq, pieces) in enumerate(compiled):
+        plan[-1] += ("|" if i else "") + key + eq
+        if overrides and key in overrides:
+            pieces = [overrides[key]]
+        for j, piece in enumerate(pieces):
+            if j % 2 == 0:
+                plan[-1] += piece
+            elif piece in constants:
+                plan[-1] += constants[piece]
+            else:
+                plan.extend([piece, ""])
+    return plan
+
+
+def render_template(plan: list, columns: dict, index: pd.Index) -> pd.Series:
+    """
+    Render a bound template for every row: a plain concatenation of literal
+    text and the per-row columns (keyed by slot name), no regex involved.
+    """
+    rendered = pd.Series(plan[0], index=index, dtype=str)
+    for slot, literal in zip(plan[1::2], plan[2::2]):
+        rendered = rendered + columns[slot]
+        if literal:
+            rendered = rendered + literal
+    return rendered
+
+
+# --- Mapping registry --------------------------------------------------------
+
+MAPPING_DICT_NAMES = ("device_profile_name_map", "device_numbers_template_map")
+
+ALT_SUFFIX = "_ALT"
+
+
+def model_key(name) -> str:
+    """
+    Normalized (stripped, upper-case) model name used by the registry.
+    """
+    return str(name).strip().upper()
+
+
+def find_duplicate_keys(source: str) -> list:
+    """
+    Keys given more than once in the mapping dict literals of a mappings.py
+    source – Python silently keeps the last one. Returns
+    (dict name, key, [values in order]) tuples.
+    """
+    duplicates = []
+    for node in ast.walk(ast.parse(source)):
+        if not isinstance(node, ast.Assign) or not isinstance(node.value, ast.Dict):
+            continue
+        names = [t.id for t in node.targets if isinstance(t, ast.Name)]
+        if not set(names) & set(MAPPING_DICT_NAMES):
+            continue
+
+        values = {}
+        for key, value in zip(node.value.keys, node.value.values):
+            if isinstance(key, ast.Constant) and isinstance(value, ast.Constant):
+                values.setdefault(key.value, []).append(value.value)
+        duplicates.extend(
+            (names[0], key, found) for key, found in values.items() if len(found) > 1
+        )
+    return duplicates
+
+
+def build_registry(profile_map: dict, template_map: dict, duplicates=()) -> dict:
+    """
+    Validate the two mapping dicts and precompute everything the hot paths
+    look up, keyed by model_key:
+
+    - 'models': model names to match, in mappings order (no _ALT entries)
+    - 'matcher': ModelMatcher over 'models'
+    - 'profile', 'device_type': model → device profile / device type
+    - 'template', 'alt_template': model → compiled template / compiled
+      _ALT template (used when MAC/SN are excluded)
+    - 'version': hash of the mappings, part of every cache key
+    - 'problems': human-readable validation messages
+    - 'maps', 'duplicates': the inputs, for layering overlays on top
+
+    `duplicates` is the result of find_duplicate_keys for the source.
+    """
+    problems = []
+    for dict_name, key, values in duplicates:
+        if len(set(map(repr, values))) > 1:
+            problems.append(
+                f"{key!r} is defined {len(values)} times in {dict_name} with "
+                f"different values; the last one ({values[-1]!r}) is used"
+            )
+        else:
+            problems.append(f"{key!r} is defined {len(values)} times in {dict_name}")
+
+    models = []
+    profile = {}
+    device_type = {}
+    for name, value in profile_map.items():
+        key = model_key(name)
+        if key.endswith(ALT_SUFFIX):
+            problems.append(
+                f"{name!r} in device_profile_name_map is ignored "
+                "(_ALT entries belong in device_numbers_template_map)"
+            )
+            continue
+        if key in profile:
+            problems.append(
+                f"{name!r} clashes with another device_profile_name_map entry "
+                "that differs only in case; the last one is used"
+            )
+        else:
+            models.append(str(name))
+        profile[key] = value
+        device_type[key] = device_profile_to_type(value)
+
+    template = {}
+    alt_template = {}
+    for name, value in template_map.items():
+        key = model_key(name)
+        if key.endswith(ALT_SUFFIX):
+            base = key[: -len(ALT_SUFFIX)]
+            if base not in profile:
+                problems.append(
+                    f"{name!r} has no {base!r} entry in device_profile_name_map"
+                )
+            target, key = alt_template, base
+        else:
+            target = template
+        if value:
+            target[key] = compile_template(value)
+
+    for name in models:
+        if model_key(name) not in template:
+            problems.append(
+                f"{name!r} has no device_numbers template; the generic "
+                "MAC/SN/FSAN fallback is used"
+            )
+
+    return {
+        "models": models,
+        "matcher": ModelMatcher(models),
+        "profile": profile,
+        "device_type": device_type,
+        "template": template,
+        "alt_template": alt_template,
+        "version": hashlib.sha256(
+            repr((profile_map, template_map)).encode()
+        ).hexdigest()[:16],
+        "problems": problems,
+        "maps": (profile_map, template_map),
+        "duplicates": list(duplicates),
+    }
+
+
+# --- Mapping store -----------------------------------------------------------
+
+# Where the mappings are read from: mappings.py next to this file, or the
+# .py/.json/.yaml/.yml/.sqlite/.sqlite3/.db file named by CALIX_MAPPINGS
+MAPPINGS_PATH = Path(
+    os.environ.get("CALIX_MAPPINGS") or Path(__file__).with_name("mappings.py")
+)
+
+
+def mapping_pairs_to_dict(dict_name: str, pairs, duplicates: list) -> dict:
+    """
+    dict(pairs), noting keys given more than once (the last one wins) in
+    `duplicates` as (dict name, key, [values in order]).
+    """
+    values = {}
+    for key, value in pairs:
+        values.setdefault(key, []).append(value)
+    duplicates.extend(
+        (dict_name, key, found) for key, found in values.items() if len(found) > 1
+    )
+    return {key: found[-1] for key, found in values.items()}
+
+
+def load_mappings_py(path: Path) -> tuple:
+    """
+    Read the two dict literals from a mappings.py-style file (evaluated as
+    literals, never executed).
+    """
+    source = path.read_text(encoding="utf-8")
+    maps = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Dict):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id in MAPPING_DICT_NAMES:
+                    maps[target.id] = ast.literal_eval(node.value)
+    missing = [name for name in MAPPING_DICT_NAMES if name not in maps]
+    if missing:
+        raise ValueError(f"{path} does not define {', '.join(missing)}")
+    return (*(maps[name] for name in MAPPING_DICT_NAMES), find_duplicate_keys(source))
+
+
+def mapping_sections(path: Path, data, mapping_type) -> dict:
+    """
+    The two mappings of a parsed JSON/YAML document, as {name: mapping}.
+    Raises ValueError unless the document is a mapping holding both, each
+    of them a mapping too (`mapping_type` is how the parser returns one).
+    """
+    if not isinstance(data, mapping_type):
+        raise ValueError(
+            f"{path} must hold an object with {' and '.join(MAPPING_DICT_NAMES)}"
+        )
+    top = dict(data)
+    missing = [name for name in MAPPING_DICT_NAMES if name not in top]
+    if missing:
+        raise ValueError(f"{path} does not define {', '.join(missing)}")
+    for name in MAPPING_DICT_NAMES:
+        if not isinstance(top[name], mapping_type):
+            raise ValueError(f"{name} in {path} is not an object of model → value")
+    return top
+
+
+def load_mappings_json(path: Path) -> tuple:
+    """
+    Read {"device_profile_name_map": {...}, "device_numbers_template_map":
+    {...}} from a JSON file.
+    """
+    # Keep objects as tuples of key/value pairs (arrays stay lists), so
+    # repeated keys can be reported
+    data = json.loads(path.read_text(encoding="utf-8"), object_pairs_hook=tuple)
+    top = mapping_sections(path, data, tuple)
+    duplicates = []
+    maps = [
+        mapping_pairs_to_dict(name, top[name], duplicates)
+        for name in MAPPING_DICT_NAMES
+    ]
+    return (*maps, duplicates)
+
+
+def load_mappings_yaml(path: Path) -> tuple:
+    """
+    Read the two mappings from a YAML file (same layout as the JSON file).
+    Needs PyYAML.
+    """
+    if yaml is None:
+        raise ValueError("reading .yaml mappings needs PyYAML (pip install pyyaml)")
+    data = yaml.safe_load(path.read_text(encoding="utf-8"))
+    top = mapping_sections(path, data, dict)
+    return (*(top[name] for name in MAPPING_DICT_NAMES), [])
+
+
+def load_mappings_sqlite(path: Path) -> tuple:
+    """
+    Read the two mappings from a SQLite database with one two-column table
+    per mapping, named like the mapping: (model, profile) and (model,
+    template). Rows are read in insertion order.
+    """
+    # Read-only, so a missing file is an error instead of a new database
+    with closing(sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)) as db:
+        duplicates = []
+        maps = [
+            mapping_pairs_to_dict(
+                name,
+                db.execute(f"SELECT * FROM {name} ORDER BY rowid").fetchall(),
+                duplicates,
+            )
+            for name in MAPPING_DICT_NAMES
+        ]
+    return (*maps, duplicates)
+
+
+# File suffix → loader returning (profile_map, template_map, duplicates)
+MAPPING_LOADERS = {
+    ".py": load_mappings_py,
+    ".json": load_mappings_json,
+    ".yaml": load_mappings_yaml,
+    ".yml": load_mappings_yaml,
+    ".sqlite": load_mappings_sqlite,
+    ".sqlite3": load_mappings_sqlite,
+    ".db": load_mappings_sqlite,
+}
+
+
+def load_mappings(path: Path) -> tuple:
+    """
+    (profile_map, template_map, duplicates) from `path`, read with the
+    loader for its suffix (see MAPPING_LOADERS). Raises ValueError for an
+    unsupported file or a mapping entry that is not text → text.
+    """
+    loader = MAPPING_LOADERS.get(path.suffix.lower())
+    if loader is None:
+        raise ValueError(f"unsupported mappings file type: {path.name}")
+    *maps, duplicates = loader(path)
+    for name, mapping in zip(MAPPING_DICT_NAMES, maps):
+        for key, value in mapping.items():
+            if not isinstance(key, str) or not isinstance(value, str):
+                raise ValueError(
+                    f"{name} in {path}: {key!r}: {value!r} is not text → text"
+                )
+    return (*maps, duplicates)
+
+
+def load_registry(path: Path) -> dict:
+    """
+    Load, validate and compile the mappings in `path` (see load_mappings).
+    """
+    return build_registry(*load_mappings(path))
+
+
+def mappings_file_stamp(path: Path) -> tuple:
+    """
+    Cheap change check for the mappings file: (mtime, size) of the file and
+    of its SQLite write-ahead log, if any.
+    """
+    stamp = []
+    for candidate in (path, path.with_name(path.name + "-wal")):
+        try:
+            stat = candidate.stat()
+        except OSError:
+            continue
+        stamp.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+
+def mappings_file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    for candidate in (path, path.with_name(path.name + "-wal")):
+        if candidate.exists():
+            digest.update(candidate.read_bytes())
+    return digest.hexdigest()
+
+
+# The live registry and what it was loaded from; replaced as a whole, so
+# readers always see one consistent registry
+_MAPPINGS = {"registry": None, "stamp": None, "digest": None, "error": None}
+_MAPPINGS_LOCK = threading.Lock()
+
+
+def refresh_mappings() -> dict:
+    """
+    Reload the mappings if their file changed since the last call and
+    return the current registry.
+
+    The file's mtime/size is checked first and its content hash only when
+    that changed, so calling this on every app rerun is cheap. Changed
+    mappings are compiled into a new registry, which is swapped in at once;
+    work already running keeps the registry it started with. If the file
+    no longer loads, the previous registry stays in use and the error is
+    reported by mappings_error().
+    """
+    path = MAPPINGS_PATH
+    stamp = mappings_file_stamp(path)
+    if stamp == _MAPPINGS["stamp"] and _MAPPINGS["registry"] is not None:
+        return _MAPPINGS["registry"]
+
+    with _MAPPINGS_LOCK:
+        if stamp == _MAPPINGS["stamp"] and _MAPPINGS["registry"] is not None:
+            return _MAPPINGS["registry"]  # another thread reloaded it
+
+        try:
+            digest = mappings_file_digest(path)
+            if digest == _MAPPINGS["digest"]:
+                _MAPPINGS.update(stamp=stamp, error=None)  # touched, not changed
+                return _MAPPINGS["registry"]
+            registry = load_registry(path)
+        except (OSError, ValueError, SyntaxError, sqlite3.Error) as exc:
+            if _MAPPINGS["registry"] is None:
+                raise
+            _MAPPINGS.update(stamp=stamp, error=f"{path.name}: {exc}")
+            return _MAPPINGS["registry"]
+
+        _MAPPINGS.update(registry=registry, stamp=stamp, digest=digest, error=None)
+        match_description.cache_clear()  # results for the old matcher
+        return registry
+
+
+def current_registry() -> dict:
+    """
+    The registry in use, without checking the file for changes.
+    """
+    return _MAPPINGS["registry"] or refresh_mappings()
+
+
+def mappings_version() -> str:
+    """
+    Version of the current mappings – part of every cache key.
+    """
+    return current_registry()["version"]
+
+
+def mappings_error():
+    """
+    Why the last reload of a changed mappings file failed, or None.
+    """
+    return _MAPPINGS["error"]
+
+
+refresh_mappings()
+
+
+# --- Tenant overlays ---------------------------------------------------------
+
+# Per-company additions/changes to the mappings: one file per company in
+# this directory, named after tenant_key(company name) with any suffix from
+# MAPPING_LOADERS (e.g. mapping_overlays/acme_isp.json), in the same layout
+# as the mappings file (both mappings, either of them may be empty)
+MAPPING_OVERLAYS_DIR = Path(
+    os.environ.get("CALIX_MAPPING_OVERLAYS")
+    or Path(__file__).with_name("mapping_overlays")
+)
+
+
+def tenant_key(company_name) -> str:
+    """
+    Overlay name for a company name: lower case, runs of anything but
+    letters and digits turned into '_' ('Acme ISP, Inc.' → 'acme_isp_inc').
+    """
+    return re.sub(r"[^a-z0-9]+", "_", str(company_name or "").lower()).strip("_")
+
+
+def overlay_path(company_name):
+    """
+    The overlay file for a company, or None when it has none.
+    """
+    key = tenant_key(company_name)
+    if not key:
+        return None
+    for suffix in MAPPING_LOADERS:
+        path = MAPPING_OVERLAYS_DIR / f"{key}{suffix}"
+        if path.is_file():
+            return path
+    return None
+
+
+def overlay_map(base: dict, overlay: dict) -> dict:
+    """
+    `base` with the entries of `overlay` on top. An overlay entry replaces
+    the value of the base entry for the same model (whatever its case) in
+    place; new models are added at the end.
+    """
+    replaced = {model_key(name): name for name in overlay}
+    merged = {}
+    for name, value in base.items():
+        key = model_key(name)
+        if key in replaced:
+            value = overlay[replaced.pop(key)]
+        merged[name] = value
+    for name in replaced.values():
+        merged[name] = overlay[name]
+    return merged
+
+
+# Compiled registry per tenant and what it was built from
+_TENANTS = {}
+_TENANTS_LOCK = threading.Lock()
+
+
+def tenant_registry(company_name: str = "") -> dict:
+    """
+    The registry for one company: the current mappings with the company's
+    overlay on top, or the current registry itself when there is none.
+
+    Each tenant's registry is compiled once and kept, so switching between
+    companies costs a stat() of the overlay file. It is rebuilt when the
+    overlay file or the base mappings change. If a changed overlay no
+    longer loads, the previous one stays in use (or the base mappings, the
+    first time) and the error is reported by tenant_error().
+    """
+    base = current_registry()
+    path = overlay_path(company_name)
+    if path is None:
+        return base
+
+    key = tenant_key(company_name)
+    stamp = (str(path), mappings_file_stamp(path), base["version"])
+    entry = _TENANTS.get(key)
+    if entry is not None and entry["stamp"] == stamp:
+        return entry["registry"]
+
+    with _TENANTS_LOCK:
+        entry = _TENANTS.get(key)
+        if entry is not None and entry["stamp"] == stamp:
+            return entry["registry"]  # another thread compiled it
+
+        # Keep the last good overlay, unless it was built on older mappings
+        if entry is not None and entry["base"] == base["version"]:
+            fallback = entry["registry"]
+        else:
+            fallback = base
+        try:
+            profile_map, template_map, duplicates = load_mappings(path)
+            registry = build_registry(
+                overlay_map(base["maps"][0], profile_map),
+                overlay_map(base["maps"][1], template_map),
+                base["duplicates"] + duplicates,
+            )
+        except (OSError, ValueError, SyntaxError, sqlite3.Error) as exc:
+            registry, error = fallback, f"{path.name}: {exc}"
+        else:
+            error = None
+
+        _TENANTS[key] = {
+            "registry": registry,
+            "stamp": stamp,
+            "base": base["version"],
+            "error": error,
+        }
+        return registry
+
+
+def tenant_error(company_name: str = ""):
+    """
+    Why the company's overlay file could not be loaded, or None.
+    """
+    entry = _TENANTS.get(tenant_key(company_name))
+    return entry["error"] if entry and overlay_path(company_name) else None
+
+
+# --- Identifier normalization & validation ----------------------------------
+
+IDENTIFIER_ROLES = ("mac", "sn", "fsan")
+
+# Separators people write between MAC address bytes
+MAC_SEPARATORS_RE = r"[\s:.\-]"
+
+# What a well-formed value looks like once normalized, per role
+IDENTIFIER_PATTERNS = {
+    "mac": r"[0-9A-F]{12}",
+    "sn": r"[!-~]+",  # printable ASCII, no spaces
+    "fsan": r"[A-Z]{4}[0-9A-F]{8}",  # vendor ID + 8 hex digits
+}
+
+
+def normalize_identifiers(values: pd.Series, role: str) -> pd.Series:
+    """
+    Canonical text for a whole MAC/SN/FSAN column at once: missing values
+    become '' and everything is stripped. MACs written with separators or
+    in lower case ('aa:bb:cc-dd.ee.ff') become 12 upper-case hex digits;
+    a MAC that is not 12 hex digits even then is left as written. FSANs
+    are upper-cased.
+    """
+    text = values.astype(str).where(values.notna(), "").str.strip()
+    if role == "mac":
+        mac = text.str.upper()
+        canonical = mac.str.fullmatch(IDENTIFIER_PATTERNS["mac"])
+        if not canonical.all():  # only then pay for the separator regex
+            mac = mac.str.replace(MAC_SEPARATORS_RE, "", regex=True)
+            canonical = mac.str.fullmatch(IDENTIFIER_PATTERNS["mac"])
+        text = mac.where(canonical, text)
+    elif role == "fsan":
+        text = text.str.upper()
+    return text
+
+
+def identifier_text(df: pd.DataFrame, col, role: str) -> pd.Series:
+    """
+    normalize_identifiers for one column of df. A missing column gives
+    empty strings.
+    """
+    if col is None or col not in df.columns:
+        return pd.Series("", index=df.index, dtype=str)
+    return normalize_identifiers(df[col], role)
+
+
+def identifier_checks(df: pd.DataFrame, columns: dict) -> pd.DataFrame:
+    """
+    Validation flags for every row, computed over whole columns:
+    'no_ids' when MAC, SN and FSAN are all empty (the row is not exported)
+    and '<role>_invalid' when a value does not look like
+    IDENTIFIER_PATTERNS[role] after normalization.
+    """
+    values = {
+        role: identifier_text(df, columns[role], role) for role in IDENTIFIER_ROLES
+    }
+    empty = {role: (text == "").to_numpy(dtype=bool) for role, text in values.items()}
+    checks = {"no_ids": empty["mac"] & empty["sn"] & empty["fsan"]}
+    for role, text in values.items():
+        well_formed = text.str.fullmatch(IDENTIFIER_PATTERNS[role])
+        checks[f"{role}_invalid"] = ~empty[role] & ~well_formed.to_numpy(dtype=bool)
+    return pd.DataFrame(checks, index=df.index)
+
+
+# --- Device detection --------------------------------------------------------
+
+
+def build_devices_from_descriptions(
+    df: pd.DataFrame, desc_col: str, tenant: str = ""
+) -> list:
+    """
+    Scan the description column, find all known models from mappings.py (and
+    the tenant's overlay, see tenant_registry), and return a list of device
+    dicts with counts and default ONT fields.
+
+    Uses "word-ish" boundaries so 'GM1028' does NOT match 'GM1028H'.
+    All models are matched in one pass (see ModelMatcher) and the
+    labels are kept in df[MATCHED_MODEL_COL] for the export step.
+    """
+    registry = tenant_registry(tenant)
+    labels = ensure_labels(df, desc_col, registry)
+    return devices_from_counts(labels.value_counts(), registry)
+
+
+def devices_from_counts(model_counts, registry: dict = None) -> list:
+    """
+    Turn per-model record counts (a dict or Series keyed by model name) into
+    device dicts, in mappings order. Models with no records are left out.
+    """
+    registry = registry or current_registry()
+    devices = []
+
+    for device_name in registry["models"]:
+        key = model_key(device_name)
+        pattern = device_name
+
+        count = int(model_counts.get(device_name, 0))
+        if count == 0:
+            continue
+
+        # Try to pull defaults for ONT_PORT / ONT_PROFILE_ID from the template
+        compiled = registry["template"].get(key, [])
+
+        ont_port = template_field_value(compiled, "ONT_PORT")
+        ont_profile_id = template_field_value(compiled, "ONT_PROFILE_ID")
+
+        devices.append(
+            {
+                "model_name": pattern,  # used to match Item Description
+                "device_name": device_name,
+                "device_type": registry["device_type"][key],
+                "location": "WAREHOUSE",       # default; editable in UI
+                "ONT_PORT": ont_port,
+                "ONT_PROFILE_ID": ont_profile_id,
+                "exclude_mac_sn": False,
+                "count": count,
+            }
+        )
+
+    return devices
+
+
+def description_stats(chunk: pd.DataFrame, columns: dict) -> pd.DataFrame:
+    """
+    Per distinct description in one chunk: 'records' (rows) and how many
+    rows each identifier_checks flag is set for.
+    """
+    stats = identifier_checks(chunk, columns).astype("int64")
+    stats.insert(0, "records", 1)
+    return stats.groupby(chunk[columns["desc"]], observed=True).sum()
+
+
+def chunk_description_stats(chunk: pd.DataFrame, columns: dict):
+    """
+    (description_stats, row count) for one chunk.
+    """
+    return description_stats(chunk, columns), len(chunk)
+
+
+def scan_description_stats(chunks, columns: dict, max_workers: int = 1):
+    """
+    Add up description_stats over all chunks, in `max_workers` processes
+    (see map_shards). Returns (description_stats, total_rows).
+
+    The stats do not depend on the mappings, so per-model stats for any
+    tenant can be derived from them (see model_stats) without reading the
+    file again.
+    """
+    stats = None
+    total_rows = 0
+    for chunk_stats, rows in map_shards(
+        chunk_description_stats, chunks, columns, max_workers=max_workers
+    ):
+        stats = chunk_stats if stats is None else stats.add(chunk_stats, fill_value=0)
+        total_rows += rows
+    if stats is None:
+        return description_stats(pd.DataFrame(columns=[columns["desc"]]), columns), 0
+    return stats.astype("int64"), total_rows
+
+
+def model_stats(description_stats: pd.DataFrame, registry: dict = None) -> pd.DataFrame:
+    """
+    Per-model sums of per-description stats (see scan_description_stats),
+    matching each distinct description once. Its 'records' column is the
+    per-model record count.
+    """
+    labels = match_models(description_stats.index.to_series(), registry)
+    return description_stats.groupby(labels.to_numpy()).sum()
+
+
+def scan_model_counts(chunks, columns: dict, max_workers: int = 1, tenant: str = ""):
+    """
+    Per-model record counts over all chunks, for the tenant's mappings.
+    Returns (model_counts, total_rows).
+    """
+    stats, total_rows = scan_description_stats(chunks, columns, max_workers)
+    return model_stats(stats, tenant_registry(tenant))["records"], total_rows
+
+
+# --- Export ------------------------------------------------------------------
+
+
+def build_device_numbers(
+    rows: pd.DataFrame,
+    device: dict,
+    compiled: list,
+    fsan_label: str,
+    mac_col,
+    sn_col,
+    fsan_col,
+) -> pd.Series:
+    """
+    Build the device_numbers string for all rows of one device at once,
+    using whole-column string concatenation instead of a per-row loop.
+
+    `compiled` is the device's compiled template ([] for the generic
+    fallback). MAC/SN/FSAN are normalized first (see
+    normalize_identifiers); rows where all three are empty are dropped.
+    """
+    mac = identifier_text(rows, mac_col, "mac")
+    sn = identifier_text(rows, sn_col, "sn")
+    fsan = identifier_text(rows, fsan_col, "fsan")
+
+    # If we truly have nothing, skip
+    keep = (mac != "") | (sn != "") | (fsan != "")
+    mac, sn, fsan = mac[keep], sn[keep], fsan[keep]
+
+    if compiled:
+        # 🔧 Override ONT_PORT / ONT_PROFILE_ID literals for ONTs,
+        # so UI edits actually change the output even if the template
+        # hardcodes those values. Done once on the template, not per row.
+        overrides = {}
+        if device["device_type"] == "ONT":
+            for key in ("ONT_PORT", "ONT_PROFILE_ID"):
+                if device.get(key):
+                    overrides[key] = device[key]
+
+        plan = bind_template(
+            compiled,
+            {
+                "ONT_PORT": device.get("ONT_PORT", ""),
+                "ONT_PROFILE_ID": device.get("ONT_PROFILE_ID", ""),
+            },
+            overrides,
+        )
+        return render_template(
+            plan, {"MAC": mac, "SN": sn, "FSAN": fsan}, mac.index
+        )
+
+    # Very generic fallback: only the non-empty parts, joined by "|"
+    device_numbers = pd.Series("", index=mac.index, dtype=str)
+    for label, values in (("MAC", mac), ("SN", sn), (fsan_label, fsan)):
+        part = (f"{label}=" + values).where(values != "", "")
+        sep = pd.Series("", index=mac.index, dtype=str).where(
+            (device_numbers == "") | (part == ""), "|"
+        )
+        device_numbers = device_numbers + sep + part
+
+    return device_numbers
+
+
+# Map device profile → FSAN label in the template
+FSAN_LABEL_MAP = {
+    "ONT": "ONT_FSAN",
+    "CX_ROUTER": "ROUTER_FSAN",
+    "CX_MESH": "MESH_FSAN",
+    "CX_SFP": "SIP_FSAN",
+    "GAM_COAX_ENDPOINT": "GAM_FSAN",
+}
+
+EXPORT_HEADER = (
+    "device_profile,device_name,device_numbers,inventory_location,inventory_status\n"
+)
+
+# Characters that make csv.writer (QUOTE_MINIMAL) quote a field
+CSV_QUOTE_CHARS_RE = re.compile(r'[",\r\n]')
+
+
+def csv_field(value) -> str:
+    """
+    One value as a CSV field, quoted exactly like csv.writer's default
+    (QUOTE_MINIMAL) dialect: only when it holds a comma, quote or line
+    break, with embedded quotes doubled.
+    """
+    value = str(value)
+    if CSV_QUOTE_CHARS_RE.search(value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def csv_column(values: pd.Series) -> pd.Series:
+    """
+    csv_field over a whole text column at once.
+    """
+    needs_quotes = values.str.contains(CSV_QUOTE_CHARS_RE.pattern, regex=True)
+    if not needs_quotes.any():
+        return values
+    quoted = '"' + values.str.replace('"', '""', regex=False) + '"'
+    return values.where(~needs_quotes, quoted)
+
+
+def export_lines(
+    df: pd.DataFrame,
+    device: dict,
+    columns: dict,
+    registry: dict = None,
+    labels: pd.Series = None,
+) -> pd.Series:
+    """
+    Build the finished export lines (newline-terminated) for one device.
+    `columns` is the dict returned by find_columns; `registry` defaults to
+    the current mappings and `labels` to df[MATCHED_MODEL_COL] (see
+    ensure_labels).
+    """
+    registry = registry or current_registry()
+    if labels is None:
+        labels = df[MATCHED_MODEL_COL]
+    name = device["device_name"]
+    model = device["model_name"]
+    dtype = device["device_type"]
+
+    key = model_key(name)
+
+    # Profile from mappings; fall back if somehow missing
+    profile = registry["profile"].get(key) or f"CX_{dtype}"
+
+    fsan_label = FSAN_LABEL_MAP.get(profile, "FSAN")
+
+    templates = registry["alt_template" if device.get("exclude_mac_sn") else "template"]
+    compiled = templates.get(key, [])
+
+    # Rows were labelled once by build_devices_from_descriptions
+    matches = df[labels == model]
+
+    device_numbers = build_device_numbers(
+        matches,
+        device,
+        compiled,
+        fsan_label,
+        columns["mac"],
+        columns["sn"],
+        columns["fsan"],
+    )
+
+    # Rows are written as CSV (quoted where needed), a column at a time
+    return (
+        f"{csv_field(profile)},{csv_field(name)},"
+        + csv_column(device_numbers)
+        + f",{csv_field(device['location'])},UNASSIGNED\n"
+    )
+
+
+def write_export(
+    df: pd.DataFrame, devices: list, columns: dict, out, tenant: str = ""
+) -> int:
+    """
+    Write the Calix import file (header + one line per record) to the text
+    stream `out`, one device at a time, with the tenant's mappings.
+    Returns the number of records.
+    """
+    registry = tenant_registry(tenant)
+    labels = ensure_labels(df, columns["desc"], registry)
+
+    out.write(EXPORT_HEADER)
+
+    total_records = 0
+    for device in devices:
+        lines = export_lines(df, device, columns, registry, labels)
+        out.write("".join(lines))
+        total_records += len(lines)
+
+    return total_records
+
+
+def export_file_name(company_name: str = "", timestamp: bool = True) -> str:
+    """
+    '<company>_<timestamp>.csv', or 'inventory_<timestamp>.csv' without a
+    company name. Without the timestamp ('<company>.csv') for names that
+    must not change between builds, e.g. inside a cached zip. Runs of
+    characters outside [A-Za-z0-9._-] become '_', so a name such as
+    'AT&T / Midwest' cannot add directories to a path or zip member.
+    """
+    base_name = re.sub(r"[^A-Za-z0-9._-]+", "_", str(company_name or ""))
+    base_name = base_name.strip("._") or "inventory"
+    if not timestamp:
+        return f"{base_name}.csv"
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{base_name}_{ts}.csv"
+
+
+def unique_file_name(name: str, used_names: set) -> str:
+    """
+    `name`, or '<stem>_2<ext>', '<stem>_3<ext>', ... when it is already in
+    `used_names` (e.g. 'site.csv' and 'site.xlsx' in the same batch). The
+    name returned is added to `used_names`.
+    """
+    base, ext = os.path.splitext(name)
+    suffix = 1
+    while name in used_names:
+        suffix += 1
+        name = f"{base}_{suffix}{ext}"
+    used_names.add(name)
+    return name
+
+
+# --- Output files ------------------------------------------------------------
+
+# Export compression choices → suffix for the downloaded/written file
+EXPORT_COMPRESSIONS = {None: "", "gzip": ".gz", "zip": ".zip"}
+
+# Exports up to this size are spooled in memory, bigger ones on disk
+SPOOL_MAX_BYTES = 16 * 2**20
+
+
+def compressed_file_name(file_name: str, compression: str = None) -> str:
+    """
+    'x.csv' → 'x.csv.gz' for gzip, 'x.zip' for zip, unchanged otherwise.
+    """
+    if compression == "zip":
+        return os.path.splitext(file_name)[0] + ".zip"
+    return file_name + EXPORT_COMPRESSIONS[compression]
+
+
+def open_zip_member(archive: zipfile.ZipFile, arcname: str):
+    """
+    Open a new deflated member of `archive` for writing (binary, any size),
+    stamped with the current time.
+    """
+    entry = zipfile.ZipInfo(arcname, date_time=datetime.now().timetuple()[:6])
+    entry.compress_type = zipfile.ZIP_DEFLATED
+    return archive.open(entry, "w", force_zip64=True)
+
+
+@contextmanager
+def export_writer(target, compression: str = None, arcname: str = "export.csv"):
+    """
+    A text stream that writes UTF-8 into the binary file `target`,
+    optionally compressed: 'gzip', or 'zip' holding one file named
+    `arcname`. Data is encoded (and compressed) as it is written, never
+    collected as one string. `target` is left open.
+    """
+    if compression not in EXPORT_COMPRESSIONS:
+        raise ValueError(f"unknown compression: {compression!r}")
+
+    with ExitStack() as stack:
+        raw = target
+        if compression == "gzip":
+            # mtime=0 so the same export always gives the same bytes
+            raw = stack.enter_context(
+                gzip.GzipFile(fileobj=target, mode="wb", mtime=0)
+            )
+        elif compression == "zip":
+            archive = stack.enter_context(
+                zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED)
+            )
+            raw = stack.enter_context(open_zip_member(archive, arcname))
+
+        out = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        try:
+            yield out
+        finally:
+            out.flush()
+            out.detach()  # closing the wrapper would close `raw`
+
+
+def spool_export(write, compression: str = None, arcname: str = "export.csv"):
+    """
+    Call write(out) (e.g. a write_export partial) into a spooled temporary
+    file: kept in memory up to SPOOL_MAX_BYTES, on disk beyond that.
+    Returns (file rewound to the start, total_records); close the file when
+    done with it.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        with export_writer(spool, compression, arcname) as out:
+            total_records = write(out)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, total_records
+
+
+# --- Part files --------------------------------------------------------------
+
+MANIFEST_NAME = "manifest.csv"
+
+
+def chunk_records(
+    chunk: pd.DataFrame, devices: list, columns: dict, tenant: str = ""
+) -> list:
+    """
+    chunk_segments for part files: each device's lines as UTF-8 bytes, plus
+    the byte length of every record, so parts can be cut from them without
+    parsing the CSV again. Returns one (data, record_lengths) pair per
+    device.
+    """
+    registry = tenant_registry(tenant)
+    labels = ensure_labels(chunk, columns["desc"], registry)
+
+    records = []
+    for device in devices:
+        lines = [
+            line.encode("utf-8")
+            for line in export_lines(chunk, device, columns, registry, labels)
+        ]
+        records.append((b"".join(lines), array("q", map(len, lines))))
+    return records
+
+
+def plan_parts(record_counts: list, max_records: int) -> list:
+    """
+    Cut the records of every device, in device order, into parts of at most
+    `max_records` records. Returns one list per part of (device index,
+    start, stop) record ranges. Raises ValueError when max_records < 1.
+    """
+    if max_records < 1:
+        raise ValueError(f"max_records must be at least 1, not {max_records}")
+
+    parts = []
+    pieces = []
+    room = max_records
+    for index, count in enumerate(record_counts):
+        start = 0
+        while start < count:
+            stop = min(count, start + room)
+            pieces.append((index, start, stop))
+            room -= stop - start
+            start = stop
+            if room == 0:
+                parts.append(pieces)
+                pieces = []
+                room = max_records
+    if pieces:
+        parts.append(pieces)
+    return parts
+
+
+def part_file_name(file_name: str, part: int) -> str:
+    """
+    'x.csv' → 'x_part001.csv' for part 1.
+    """
+    stem, ext = os.path.splitext(file_name)
+    return f"{stem}_part{part:03d}{ext}"
+
+
+def write_export_parts(
+    chunks,
+    devices: list,
+    columns: dict,
+    target,
+    max_records: int,
+    file_name: str = "export.csv",
+    max_workers: int = 1,
+    tenant: str = "",
+) -> int:
+    """
+    Write the export of `chunks` (see write_export_chunks) as a zip of part
+    files of at most `max_records` records, each with its own header row,
+    to the binary file `target`. MANIFEST_NAME in the zip lists the record
+    count of every device in every part. Returns the number of records.
+
+    The parts are rendered with the chunks, on max_workers processes (see
+    map_shards): each device's records go to a spill file along with their
+    lengths, and every part is then copied from byte ranges of the spills.
+    Together the parts hold the records of the single file, in its order.
+    """
+    spills = [tempfile.TemporaryFile() for _ in devices]
+    lengths = [array("q") for _ in devices]
+    try:
+        for records in map_shards(
+            chunk_records,
+            chunks,
+            devices,
+            columns,
+            tenant,
+            max_workers=max_workers,
+        ):
+            for (data, record_lengths), spill, device_lengths in zip(
+                records, spills, lengths
+            ):
+                spill.write(data)
+                device_lengths.extend(record_lengths)
+
+        for spill in spills:
+            spill.seek(0)
+        record_counts = [len(device_lengths) for device_lengths in lengths]
+        parts = plan_parts(record_counts, max_records)
+
+        header = EXPORT_HEADER.encode("utf-8")
+        manifest = []  # (part file, device name, records)
+        with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for part, pieces in enumerate(parts, 1):
+                name = part_file_name(file_name, part)
+                with open_zip_member(archive, name) as out:
+                    out.write(header)
+                    for index, start, stop in pieces:
+                        size = sum(lengths[index][start:stop])
+                        out.write(spills[index].read(size))
+                        device_name = devices[index]["device_name"]
+                        manifest.append((name, device_name, stop - start))
+
+            lines = ["file,device_name,records\n"]
+            lines.extend(
+                f"{csv_field(name)},{csv_field(device)},{n}\n"
+                for name, device, n in manifest
+            )
+            archive.writestr(MANIFEST_NAME, "".join(lines))
+    finally:
+        for spill in spills:
+            spill.close()
+
+    return sum(record_counts)
+
+
+def spool_export_parts(
+    chunks,
+    devices: list,
+    columns: dict,
+    max_records: int,
+    file_name: str = "export.csv",
+    max_workers: int = 1,
+    tenant: str = "",
+):
+    """
+    write_export_parts into a spooled temporary file (see spool_export).
+    Returns (file rewound to the start, total_records).
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        total_records = write_export_parts(
+            chunks, devices, columns, spool, max_records, file_name, max_workers, tenant
+        )
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, total_records
+
+
+def apply_device_overrides(
+    devices: list, overrides: dict, default_location: str = "WAREHOUSE"
+) -> list:
+    """
+    Apply per-model settings (what the UI lets you edit) to a device list.
+
+    `overrides` maps a device name (case-insensitive) to a dict with any of
+    'location', 'ONT_PORT', 'ONT_PROFILE_ID', 'exclude_mac_sn', or
+    'skip': true to leave that device out. Returns a new list.
+    """
+    by_name = {str(k).upper(): v for k, v in (overrides or {}).items()}
+
+    result = []
+    for device in devices:
+        device = dict(device)
+        device["location"] = default_location or "WAREHOUSE"
+        settings = by_name.get(str(device["device_name"]).upper(), {})
+        if settings.get("skip"):
+            continue
+        if settings.get("location"):
+            device["location"] = str(settings["location"]).strip()
+        for key in ("ONT_PORT", "ONT_PROFILE_ID"):
+            if key in settings:
+                device[key] = str(settings[key])
+        if "exclude_mac_sn" in settings:
+            device["exclude_mac_sn"] = bool(settings["exclude_mac_sn"])
+        result.append(device)
+    return result
+
+
+def configure_devices(devices: list, config: dict) -> list:
+    """
+    Apply a batch/CLI config's default location and per-model overrides
+    (see apply_device_overrides and calix_convert).
+    """
+    return apply_device_overrides(
+        devices,
+        config.get("devices", {}),
+        config.get("default_location", "WAREHOUSE"),
+    )
+
+
+def chunk_segments(
+    chunk: pd.DataFrame, devices: list, columns: dict, tenant: str = ""
+) -> list:
+    """
+    Label one chunk (unless already labelled) and render its export lines
+    with the tenant's mappings. Returns one (lines, record_count) pair per
+    device.
+    """
+    registry = tenant_registry(tenant)
+    labels = ensure_labels(chunk, columns["desc"], registry)
+
+    segments = []
+    for device in devices:
+        lines = export_lines(chunk, device, columns, registry, labels)
+        segments.append(("".join(lines), len(lines)))
+    return segments
+
+
+def write_export_chunks(
+    chunks, devices: list, columns: dict, out, max_workers: int = 1, tenant: str = ""
+) -> int:
+    """
+    Streaming version of write_export for data that arrives in chunks
+    (see iter_csv_chunks, iter_shards). Returns the number of records.
+
+    Each device's lines go to their own temporary spill file while the
+    chunks are read, then the spill files are copied to `out` in device
+    order – the same layout write_export produces, in bounded memory.
+    With max_workers > 1, chunks are labelled and rendered in that many
+    processes (see map_shards); the file is byte-for-byte the same. Each
+    process compiles the tenant's mappings once (see tenant_registry).
+    """
+    spills = [tempfile.TemporaryFile("w+", encoding="utf-8") for _ in devices]
+    try:
+        total_records = 0
+        for segments in map_shards(
+            chunk_segments,
+            chunks,
+            devices,
+            columns,
+            tenant,
+            max_workers=max_workers,
+        ):
+            for (lines, count), spill in zip(segments, spills):
+                spill.write(lines)
+                total_records += count
+
+        out.write(EXPORT_HEADER)
+        for spill in spills:
+            spill.seek(0)
+            shutil.copyfileobj(spill, out)
+    finally:
+        for spill in spills:
+            spill.close()
+
+    return total_records
@@ -0,0 +1,195 @@
+"""
+Export paths that must agree byte for byte: CSV quoting, sharded vs serial
+rendering, and part files vs the single file. Uses the shipped mappings.py.
+"""
+
+import csv
+import io
+import random
+import zipfile
+
+import pandas as pd
+import pytest
+
+from calix_engine import (
+    EXPORT_HEADER,
+    MANIFEST_NAME,
+    ModelMatcher,
+    build_devices_from_descriptions,
+    csv_column,
+    csv_field,
+    export_file_name,
+    find_columns,
+    iter_shards,
+    plan_parts,
+    spool_export,
+    spool_export_parts,
+    write_export,
+    write_export_chunks,
+)
+
+QUOTING_VALUES = [
+    "",
+    "WAREHOUSE",
+    "TRUCK 7",
+    "a,b",
+    'say "hi"',
+    '"',
+    "line\nbreak",
+    "cr\rlf\r\n",
+    " padded ",
+    "semi;colon",
+    "tab\there",
+    "ünïcode, too",
+]
+
+
+def csv_writer_field(value: str) -> str:
+    buffer = io.StringIO()
+    # Two fields, so an empty value is not quoted as a lone empty row
+    csv.writer(buffer).writerow([value, "x"])
+    return buffer.getvalue()[: -len(",x\r\n")]
+
+
+@pytest.mark.parametrize("value", QUOTING_VALUES)
+def test_csv_field_quotes_like_csv_writer(value):
+    assert csv_field(value) == csv_writer_field(value)
+
+
+def test_csv_column_matches_csv_field():
+    values = pd.Series(QUOTING_VALUES, dtype=str)
+    assert csv_column(values).tolist() == [csv_field(v) for v in QUOTING_VALUES]
+
+
+@pytest.mark.parametrize(
+    "description, expected",
+    [
+        ("CALIX GM1028H MESH", "GM1028H"),
+        ("GM1028 unit", "GM1028"),
+        ("gm1028h lower case", "GM1028H"),
+        ("XGM1028H glued to a letter", None),
+        ("GM1028H-2 glued to a dash", None),
+        ("SFP-XGS module", "SFP-XGS"),
+        ("GPR2022H-ONT kit", "GPR2022H-ONT"),
+        ("(GS4227E)/GS4227", "GS4227E"),
+        ("nothing known", None),
+    ],
+)
+def test_model_matcher(description, expected):
+    models = [
+        "GM1028",
+        "GM1028H",
+        "SFP-XGS",
+        "GPR2022H",
+        "GPR2022H-ONT",
+        "GS4227E",
+        "GS4227",
+    ]
+    for automaton in (False, True):
+        code = ModelMatcher(models, automaton=automaton).search(description)
+        assert (models[code] if code >= 0 else None) == expected
+
+
+@pytest.fixture(scope="module")
+def inventory():
+    """
+    A few thousand rows over several models, with blank and malformed
+    identifiers and rows of no known model.
+    """
+    rng = random.Random(7)
+    descriptions = [
+        "CALIX GS2128XG ONT",
+        "GigaSpire GM1028H mesh",
+        "GS4227E router, refurb",
+        'SFP-XGS "module"',
+        "GP1100X",
+        "unknown widget",
+    ]
+    rows = []
+    for i in range(3000):
+        rows.append(
+            {
+                "Item Description": rng.choice(descriptions),
+                "MAC Address": rng.choice([f"00:11:22:33:{i:04X}", "", "bad-mac"]),
+                "Serial Number": rng.choice([f"SN{i:08d}", ""]),
+                "FSAN": rng.choice([f"CXNK{i:08X}", ""]),
+            }
+        )
+    df = pd.DataFrame(rows, dtype=str)
+    columns = find_columns(df.columns)
+    devices = build_devices_from_descriptions(df, columns["desc"])
+    devices[0]["location"] = 'DOCK "B", bay\n4'
+    devices[-1]["exclude_mac_sn"] = True
+    return df, columns, devices
+
+
+def export_text(write) -> tuple:
+    spool, total_records = spool_export(write)
+    with spool:
+        return spool.read().decode("utf-8"), total_records
+
+
+def test_inventory_has_several_devices(inventory):
+    _, _, devices = inventory
+    assert len(devices) >= 4
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_sharded_export_matches_serial(inventory, max_workers):
+    df, columns, devices = inventory
+    serial = export_text(lambda out: write_export(df, devices, columns, out))
+    sharded = export_text(
+        lambda out: write_export_chunks(
+            iter_shards(df, 257), devices, columns, out, max_workers
+        )
+    )
+    assert sharded == serial
+
+
+@pytest.mark.parametrize("max_records", [1, 7, 1000, 10**6])
+def test_part_files_match_single_file(inventory, max_records):
+    df, columns, devices = inventory
+    single, total_records = export_text(
+        lambda out: write_export(df, devices, columns, out)
+    )
+
+    spool, part_records = spool_export_parts(
+        iter_shards(df, 500), devices, columns, max_records, "x.csv"
+    )
+    with spool, zipfile.ZipFile(spool) as archive:
+        names = archive.namelist()
+        parts = [archive.read(name).decode("utf-8") for name in names[:-1]]
+        manifest = archive.read(MANIFEST_NAME).decode("utf-8")
+
+    records = {}
+    for row in csv.DictReader(io.StringIO(manifest)):
+        records[row["file"]] = records.get(row["file"], 0) + int(row["records"])
+
+    assert part_records == total_records
+    assert names[-1] == MANIFEST_NAME
+    assert names[:-1] == [f"x_part{n:03d}.csv" for n in range(1, len(parts) + 1)]
+    assert all(part.startswith(EXPORT_HEADER) for part in parts)
+    assert EXPORT_HEADER + "".join(p[len(EXPORT_HEADER) :] for p in parts) == single
+    assert list(records) == names[:-1]
+    assert sum(records.values()) == total_records
+    assert max(records.values()) <= max_records
+
+
+@pytest.mark.parametrize("max_records", [0, -1])
+def test_plan_parts_rejects_max_records_below_one(max_records):
+    with pytest.raises(ValueError):
+        plan_parts([5], max_records)
+
+
+@pytest.mark.parametrize(
+    "company_name, expected",
+    [
+        ("", "inventory.csv"),
+        ("Acme Fiber", "Acme_Fiber.csv"),
+        ("  AT&T / Midwest ", "AT_T_Midwest.csv"),
+        ("../..", "inventory.csv"),
+        ("co.op-net_2", "co.op-net_2.csv"),
+    ],
+)
+def test_export_file_name_is_a_single_safe_component(company_name, expected):
+    assert export_file_name(company_name, timestamp=False) == expected
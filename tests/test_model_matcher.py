@@ -0,0 +1,58 @@
+"""
+ModelMatcher's automaton against its regex: both must pick the same model
+for any description.
+"""
+
+import random
+
+from calix_engine import ModelMatcher
+
+MODEL_CHARS = "ABCGHMSX0123456789-"
+FILLER = [" ", "  ", "-", "/", "(", ")", ",", "_", ".", "x", "Z", "9", "é", "\t"]
+
+
+def random_models(rng: random.Random, count: int) -> list:
+    models = []
+    for _ in range(count):
+        if models and rng.random() < 0.3:
+            # Prefixes/extensions of known names ('GM1028' vs 'GM1028H')
+            base = rng.choice(models)
+            name = base[: rng.randint(1, len(base))] + "".join(
+                rng.choice(MODEL_CHARS) for _ in range(rng.randint(0, 2))
+            )
+        else:
+            name = "".join(rng.choice(MODEL_CHARS) for _ in range(rng.randint(1, 8)))
+        if rng.random() < 0.2:
+            name = name.lower()  # case-only duplicates
+        models.append(name)
+    return models
+
+
+def random_description(rng: random.Random, models: list) -> str:
+    pieces = []
+    for _ in range(rng.randint(0, 6)):
+        if rng.random() < 0.5:
+            model = rng.choice(models)
+            pieces.append(model.lower() if rng.random() < 0.3 else model)
+        else:
+            pieces.append(rng.choice(FILLER))
+    return "".join(pieces)
+
+
+def test_automaton_matches_regex():
+    rng = random.Random(20260216)
+    for _ in range(200):
+        models = random_models(rng, rng.randint(1, 40))
+        automaton = ModelMatcher(models, automaton=True)
+        regex = ModelMatcher(models, automaton=False)
+        for _ in range(250):
+            description = random_description(rng, models)
+            assert automaton.search(description) == regex.search(description), (
+                models,
+                description,
+            )
+
+
+def test_strategy_follows_model_count():
+    assert not ModelMatcher(["GM1028"]).automaton
+    assert ModelMatcher([f"M{i}" for i in range(1000)]).automaton